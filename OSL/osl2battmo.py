@@ -0,0 +1,178 @@
+# Conversion of OSL cell descriptions into BattMo input.
+# The knowledge graph is queried with SmwSparqlClient.get_sparql_triplets, which returns
+# {subject: {predicate: [objects]}}. A cell is a tree of parts (HasPart, named by the
+# HasBattMoPropertyName of the term they are IsA) with parameters (HasParameter, named by the
+# HasBattMoPropertyName of their HasProperty). The names are indexed once per query result and
+# every subtree is converted once, so parts shared by many cells of a catalog cost nothing extra.
+#
+# usage:
+#   from osl2battmo import OslConverter, fetch_triplets, performance_spec_requests
+#   requests = performance_spec_requests(sparqlClient, ["OSL324bc7d8ba754cc9a9cbeb6b082063b4", ...])
+
+import copy
+import os
+import sys
+from typing import Dict, List, Optional
+
+HAS_ID = "property:HasId"
+HAS_PART = "property:HasPart"
+HAS_PARAMETER = "property:HasParameter"
+HAS_PROPERTY = "property:HasProperty"
+HAS_VALUE = "property:HasValue"
+IS_A = "property:IsA"
+HAS_BATTMO_PROPERTY_NAME = "property:HasBattMoPropertyName"
+
+# cells per SPARQL query in bulk mode
+DEFAULT_BATCH_SIZE = 50
+
+# flows directory with battmo_prefect_flow (Geometry1D, PerformanceSpecRequest)
+FLOWS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prefect", "flows", "performance_spec")
+
+
+def cell_where_statement(cell_ids: List[str]) -> str:
+    """SPARQL where statement selecting the cells with all parts, parameters and property definitions"""
+    values = " ".join(f"'{cell_id}'" for cell_id in cell_ids)
+    return (
+        f"VALUES ?cell_id {{ {values} }} "
+        "?subject (^property:IsA)*/(^property:HasProperty)*/(^property:HasParameter)*/(^property:HasPart)*/property:HasId ?cell_id"
+    )
+
+
+def fetch_triplets(client, cell_ids: List[str], batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Dict[str, List[str]]]:
+    """Triplets of all cells, one query per batch_size cells"""
+    triplets = {}
+    for i in range(0, len(cell_ids), batch_size):
+        for subject, predicates in client.get_sparql_triplets(cell_where_statement(cell_ids[i : i + batch_size]), debug=False).items():
+            if subject in triplets:
+                for predicate, objects in predicates.items():
+                    triplets[subject].setdefault(predicate, []).extend(objects)
+            else:
+                triplets[subject] = predicates
+    return triplets
+
+
+def parse_value(value: str):
+    value = value.replace("wiki:", "")
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _first(predicates: Dict[str, List[str]], predicate: str) -> Optional[str]:
+    objects = predicates.get(predicate)
+    return objects[0] if objects else None
+
+
+class OslConverter:
+    """Converts cells of one triplet dict, with a name index and memoized subtrees"""
+
+    def __init__(self, triplets: Dict[str, Dict[str, List[str]]]):
+        self.triplets = triplets
+        self.names = {
+            subject: predicates[HAS_BATTMO_PROPERTY_NAME][0]
+            for subject, predicates in triplets.items()
+            if predicates.get(HAS_BATTMO_PROPERTY_NAME)
+        }
+        self._converted: Dict[str, Dict] = {}
+
+    def subject(self, cell_id: str) -> str:
+        return cell_id if cell_id.startswith("term:") else "term:" + cell_id
+
+    def _parameter(self, parameter: str):
+        """(BattMo name, value) of a parameter, None if it has no BattMo name"""
+        predicates = self.triplets.get(parameter, {})
+        name = self.names.get(_first(predicates, HAS_PROPERTY))
+        value = _first(predicates, HAS_VALUE)
+        if name is None or value is None:
+            return None
+        return name, parse_value(value)
+
+    def _parts(self, subject: str) -> List[str]:
+        return self.triplets.get(subject, {}).get(HAS_PART, [])
+
+    def _convert_node(self, subject: str) -> Dict:
+        # all parts are already converted
+        predicates = self.triplets.get(subject, {})
+        d = {}
+        for parameter in predicates.get(HAS_PARAMETER, []):
+            entry = self._parameter(parameter)
+            if entry:
+                d[entry[0]] = entry[1]
+        for part in predicates.get(HAS_PART, []):
+            name = self.names.get(_first(self.triplets.get(part, {}), IS_A))
+            if name is not None and part in self._converted:
+                d[name] = self._converted[part]
+        return d
+
+    def convert(self, subject: str) -> Dict:
+        """BattMo dict of a subject and its parts. The traversal is iterative (post-order),
+        deep part hierarchies do not hit the recursion limit. Cyclic parts are ignored."""
+        stack = [(subject, False)]
+        visiting = set()
+        while stack:
+            node, expanded = stack.pop()
+            if node in self._converted:
+                continue
+            if expanded:
+                self._converted[node] = self._convert_node(node)
+                visiting.discard(node)
+                continue
+            if node in visiting:
+                continue
+            visiting.add(node)
+            stack.append((node, True))
+            for part in self._parts(node):
+                if part not in self._converted and part not in visiting:
+                    stack.append((part, False))
+        # the memoized subtrees are shared, callers get their own copy
+        return copy.deepcopy(self._converted[subject])
+
+    def convert_cell(self, cell_id: str) -> Optional[Dict]:
+        """Geometry dict of a cell, None if the cell is not in the triplets"""
+        subject = self.subject(cell_id)
+        if subject not in self.triplets:
+            return None
+        return self.convert(subject)
+
+
+def osl2battmo(triplets: Dict[str, Dict[str, List[str]]], cell_id: str) -> Optional[Dict]:
+    """Geometry dict of a single cell"""
+    return OslConverter(triplets).convert_cell(cell_id)
+
+
+def _battmo():
+    # lazy, the flow module pulls in prefect and numpy
+    if FLOWS_DIR not in sys.path:
+        sys.path.append(FLOWS_DIR)
+    import battmo_prefect_flow
+
+    return battmo_prefect_flow
+
+
+def convert_cells(client, cell_ids: List[str], batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Dict]:
+    """Geometry dicts of many cells, fetched with one query per batch and converted in one pass"""
+    converter = OslConverter(fetch_triplets(client, cell_ids, batch_size))
+    geometries = {}
+    for cell_id in cell_ids:
+        geometry = converter.convert_cell(cell_id)
+        if geometry is None:
+            print(f"Cell {cell_id} not found")
+            continue
+        geometries[cell_id] = geometry
+    return geometries
+
+
+def geometries(client, cell_ids: List[str], batch_size: int = DEFAULT_BATCH_SIZE) -> Dict:
+    """Geometry1D objects of many cells, by cell id"""
+    battmo = _battmo()
+    return {cell_id: battmo.Geometry1D.parse_obj(d) for cell_id, d in convert_cells(client, cell_ids, batch_size).items()}
+
+
+def performance_spec_requests(client, cell_ids: List[str], batch_size: int = DEFAULT_BATCH_SIZE) -> List:
+    """PerformanceSpecRequest for every cell found, ready for simulate_performance_spec_batch"""
+    battmo = _battmo()
+    return [
+        battmo.PerformanceSpecRequest(geometry=geometry)
+        for geometry in geometries(client, cell_ids, batch_size).values()
+    ]
@@ -0,0 +1,197 @@
+# Admission control in front of the Octave simulations of this process.
+# Every octave call (a single simulation or a chunk of a batch) waits for admission. A call is
+# admitted when a core is free and the node has memory for one more simulation: MemAvailable
+# minus a reserve must cover the memory of a simulation (an EWMA of the octave worker RSS measured
+# after every job) for the new call and for the calls admitted during the last SETTLE_S seconds,
+# whose memory is not allocated yet. Waiting calls are served by priority, interactive (wiki
+# requests, single runs) before batch (optimizations, sweeps), first come first served within a
+# priority. Batch calls leave BATTMO_ADMISSION_INTERACTIVE_CORES cores to interactive ones. A call
+# is rejected if BATTMO_ADMISSION_MAX_QUEUE calls of the same or a higher priority are waiting.
+# Configuration via environment variables:
+#   BATTMO_ADMISSION_CORES              max. concurrent simulations (default: usable cores)
+#   BATTMO_ADMISSION_INTERACTIVE_CORES  cores batch calls can not use (default: 1 if more than one core)
+#   BATTMO_ADMISSION_RESERVE_MB         memory kept free for the rest of the node (default: 1024)
+#   BATTMO_ADMISSION_SIMULATION_MB      initial memory estimate of a simulation (default: 1024)
+#   BATTMO_ADMISSION_MAX_QUEUE          max. number of waiting calls per priority (default: 64, 0 = unlimited)
+#   BATTMO_ADMISSION_TIMEOUT_S          reject calls waiting longer (default: 0 = wait forever)
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import metrics
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+# seconds until the memory of an admitted simulation shows up in MemAvailable
+SETTLE_S = 10.0
+# waiting calls re-check the available memory at this interval
+POLL_S = 1.0
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def usable_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def mem_available_mb() -> Optional[float]:
+    """MemAvailable of the node in MB, read from /proc (Linux only)"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class AdmissionRejected(RuntimeError):
+    """The queue is full or the call waited longer than its timeout"""
+
+
+class AdmissionController:
+    """Admits simulations by priority while cores and memory are available, thread safe"""
+
+    def __init__(
+        self,
+        cores: Optional[int] = None,
+        interactive_cores: Optional[int] = None,
+        reserve_mb: float = 1024,
+        simulation_mb: float = 1024,
+        max_queue: int = 64,
+        timeout_s: Optional[float] = None,
+        alpha: float = 0.3,
+    ):
+        self.cores = cores or usable_cores()
+        if interactive_cores is None:
+            interactive_cores = 1 if self.cores > 1 else 0
+        self.interactive_cores = max(0, min(interactive_cores, self.cores - 1))
+        self.reserve_mb = reserve_mb
+        self.simulation_mb = simulation_mb
+        self.max_queue = max_queue
+        self.timeout_s = timeout_s
+        self.alpha = alpha
+        self._running = 0
+        self._queue = [] # heap of (priority rank, arrival)
+        self._arrivals = itertools.count()
+        self._admitted_at = deque()
+        self._condition = threading.Condition()
+
+    def _cores_free(self, priority: str) -> bool:
+        limit = self.cores if priority == "interactive" else self.cores - self.interactive_cores
+        return self._running < limit
+
+    def _memory_free(self) -> bool:
+        if self._running == 0:
+            # nothing of ours to wait for
+            return True
+        available = mem_available_mb()
+        if available is None:
+            return True
+        now = time.monotonic()
+        while self._admitted_at and now - self._admitted_at[0] > SETTLE_S:
+            self._admitted_at.popleft()
+        return available - self.reserve_mb >= self.simulation_mb * (1 + len(self._admitted_at))
+
+    def _update_gauges(self):
+        for priority, rank in PRIORITIES.items():
+            depth = sum(1 for entry in self._queue if entry[0] == rank)
+            metrics.set_gauge("battmo_admission_queue_depth", depth, priority=priority)
+        metrics.set_gauge("battmo_admission_running", self._running)
+
+    def acquire(self, priority: str = "interactive", timeout: Optional[float] = None):
+        """Wait until the call is admitted, raises AdmissionRejected if the queue is full or on timeout"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}', expected one of {list(PRIORITIES)}")
+        timeout = self.timeout_s if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout if timeout else None
+        with self._condition:
+            # waiting batch calls do not count against interactive ones
+            ahead = sum(1 for entry in self._queue if entry[0] <= PRIORITIES[priority])
+            if self.max_queue and ahead >= self.max_queue:
+                metrics.inc("battmo_admission_rejected_total", priority=priority, reason="queue_full")
+                raise AdmissionRejected(f"Simulation queue is full ({ahead} waiting)")
+            entry = (PRIORITIES[priority], next(self._arrivals))
+            heapq.heappush(self._queue, entry)
+            self._update_gauges()
+            try:
+                while not (self._queue[0] is entry and self._cores_free(priority) and self._memory_free()):
+                    wait = POLL_S
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            metrics.inc("battmo_admission_rejected_total", priority=priority, reason="timeout")
+                            raise AdmissionRejected(f"Simulation not admitted within {timeout} s")
+                        wait = min(wait, remaining)
+                    self._condition.wait(wait)
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._update_gauges()
+                self._condition.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self._running += 1
+            self._admitted_at.append(time.monotonic())
+            self._update_gauges()
+            # the next call in line may fit as well
+            self._condition.notify_all()
+        metrics.observe("battmo_admission_wait_seconds", time.monotonic() - start, priority=priority)
+
+    def release(self):
+        with self._condition:
+            self._running -= 1
+            self._update_gauges()
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, priority: str = "interactive", timeout: Optional[float] = None):
+        """Hold an admission for the duration of the with-block"""
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record_rss(self, rss_mb: float):
+        """Update the memory estimate of a simulation with the RSS of a worker after a job"""
+        with self._condition:
+            self.simulation_mb += self.alpha * (rss_mb - self.simulation_mb)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            queued = {priority: sum(1 for entry in self._queue if entry[0] == rank) for priority, rank in PRIORITIES.items()}
+            return {"running": self._running, "queued": queued, "cores": self.cores, "simulation_mb": self.simulation_mb}
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_controller() -> AdmissionController:
+    """Return the process wide admission controller, created on first use"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            interactive_cores = os.environ.get("BATTMO_ADMISSION_INTERACTIVE_CORES")
+            _controller = AdmissionController(
+                cores=int(_env_float("BATTMO_ADMISSION_CORES", usable_cores())),
+                interactive_cores=int(interactive_cores) if interactive_cores else None,
+                reserve_mb=_env_float("BATTMO_ADMISSION_RESERVE_MB", 1024),
+                simulation_mb=_env_float("BATTMO_ADMISSION_SIMULATION_MB", 1024),
+                max_queue=int(_env_float("BATTMO_ADMISSION_MAX_QUEUE", 64)),
+                timeout_s=_env_float("BATTMO_ADMISSION_TIMEOUT_S", 0) or None,
+            )
+        return _controller
@@ -6,18 +6,25 @@
 # run: /home/jovyan/.local/bin/prefect agent start -p 'default-agent-pool'
 
 from prefect import flow, task
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
 from uuid import UUID, uuid4
 #from loguru import logger
-from typing import Union, Optional,List
-import sdlabs_wrapper.models as sdlabs_models
-from sdlabs_wrapper.wrapper import initialize_optimization
+from typing import Union, Optional,List,Tuple,Dict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import random
 import copy
 import battmo_prefect_flow as battmo
+from checkpoint import OptimizationCheckpoint, params_key
+from result_cache import get_cache, cache_key, battmo_version
+from metrics import FlowMetrics
+import metrics
 from prefect.blocks.system import Secret
 import os
 import fnmatch
 import json
+import math
 
 
 class ExecutedExperiment(BaseModel):
@@ -25,6 +32,13 @@ class ExecutedExperiment(BaseModel):
     spec_response: Optional[battmo.PerformanceSpecResponse] = None
     batch: Optional[int] = None
     iteration: Optional[int] = None
+    simulated: Optional[bool] = True # False if skipped by surrogate pre-screening
+    predicted_energy_density: Optional[float] = None
+    predicted_upper_bound: Optional[float] = None
+
+class PriorObservation(BaseModel):
+    geometry: battmo.Geometry1D
+    energy_density: float
 
 class BattmoOptimizationRequest(BaseModel):
     uuid: UUID = Field(default_factory=uuid4, title="UUID")
@@ -32,12 +46,65 @@ class BattmoOptimizationRequest(BaseModel):
     batch_size: int = Field(1, ge=1, le=8)
     optimizer: str = Field("gpyopt", regex="^(randomsearch|grid|dragonfly|gpyopt|sobol|latinhypercube|hyperopt)$")
     random_seed: int = Field(10,ge=1,le=1e6)
+    parallelism: int = Field(4, ge=1, le=8, description="Max. number of suggestions of a batch simulated concurrently")
+    max_in_flight: int = Field(4, ge=1, le=32, description="Max. number of suggestions fetched but not yet measured, capped at parallelism")
+    poll_initial_s: float = Field(1, gt=0, description="First backoff delay when the optimizer has no suggestions")
+    poll_max_s: float = Field(30, gt=0, description="Max. backoff delay")
+    poll_timeout_s: float = Field(180, gt=0, description="Give up asking after this time without suggestions and running simulations")
+    backend: str = Field("sdlabs", regex="^(sdlabs|local)$", description="sdlabs: remote SDLabs service, local: offline optimizer")
+    prescreen: bool = Field(False, description="Skip suggestions whose surrogate upper bound is below the best result so far")
+    prescreen_kappa: float = Field(2.0, ge=0, description="Upper bound = predicted mean + kappa * predicted std")
+    prescreen_min_points: int = Field(5, ge=2, description="Min. number of known results before screening starts")
+    resume: bool = Field(True, description="Log experiments and continue after them when a run with the same uuid is restarted (SDLabs: replay re-suggested points only)")
+    max_failures: int = Field(3, ge=1, description="Abort after this many failed simulations, their suggestions are never measured")
+    early_stop: bool = Field(False, description="Abort simulations once their energy density bound is below the best result so far, all simulations of the run use the step-wise energy density of prunable runs")
+    warm_start: bool = Field(False, description="Seed the optimizer with prior results inside the parameter bounds, see prior_observations (local backend only)")
+    warm_start_max_points: int = Field(50, ge=1, le=1000, description="Max. number of prior results, the best ones are kept")
+    seed_observations: List[PriorObservation] = Field([], description="Prior results of the caller, e.g. the current geometry of a model")
+
+    @validator("warm_start")
+    def warm_start_backend(cls, warm_start, values):
+        # SDLabs can only inherit all data of earlier optimizations with the same name, unfiltered
+        if warm_start and values.get("backend") != "local":
+            raise ValueError("warm_start requires the local backend")
+        return warm_start
     
+# request fields restored from the checkpoint when a run is resumed
+RESUME_FIELDS = ("budget", "batch_size", "optimizer", "random_seed", "backend", "early_stop")
+
 class BattmoOptimizationResult(BaseModel):
+    uuid: Optional[UUID] = None # of the optimization request, e.g. the workflow run that requested it
     experiments: List[ExecutedExperiment]
     best_run: ExecutedExperiment
-@task(log_prints=True)
-def start_optimization(request:BattmoOptimizationRequest):
+    metrics: Optional[Dict] = None # stage timings and counts of the flow run, see metrics.FlowMetrics
+
+# optimized parameters, shared by all optimizer backends
+OPTIMIZATION_PARAMETERS = [
+    {
+        "low_value": 30e-6,
+        "high_value": 150e-6,
+        "name": "negative_electrode_thickness"
+    },
+    {
+        "low_value": 30e-6,
+        "high_value": 150e-6,
+        "name": "positive_electrode_thickness"
+    },
+    {
+        "low_value": 8e-6,
+        "high_value": 15e-6,
+        "name": "separator_thickness"
+    }
+]
+OPTIMIZATION_OBJECTIVES = [
+    {
+        "name": "energy_density",
+        "goal": "max"
+    }
+]
+
+def start_sdlabs_optimization(request:BattmoOptimizationRequest):
+    from sdlabs_wrapper.wrapper import initialize_optimization
     
     secret_block = Secret.load("atinary-api-key")
 
@@ -49,29 +116,8 @@ def start_optimization(request:BattmoOptimizationRequest):
         "description": "Optimize cell layer thicknesses",
         "sdlabs_group_id": "onterface",
         "sdlabs_account_type": "academic",
-        "parameters": [
-            {
-                "low_value": 30e-6,
-                "high_value": 150e-6,
-                "name": "negative_electrode_thickness"
-            },
-            {
-                "low_value": 30e-6,
-                "high_value": 150e-6,
-                "name": "positive_electrode_thickness"
-            },
-            {
-                "low_value": 8e-6,
-                "high_value": 15e-6,
-                "name": "separator_thickness"
-            }
-        ],
-        "objectives": [
-            {
-                "name": "energy_density",
-                "goal": "max"
-            }
-        ],
+        "parameters": OPTIMIZATION_PARAMETERS,
+        "objectives": OPTIMIZATION_OBJECTIVES,
         "inherit_data": False,
         "always_restart": True,
         "batch_size": request.batch_size,
@@ -83,48 +129,342 @@ def start_optimization(request:BattmoOptimizationRequest):
     opt_wrapper = initialize_optimization(spec_file_content=optimization_config,api_key=api_key)
     return opt_wrapper
 
+def start_local_optimization(request:BattmoOptimizationRequest):
+    from local_optimizer import LocalOptimizer, LocalOptimizerConfig
+    optimization_config = LocalOptimizerConfig(
+        budget=request.budget,
+        batch_size=request.batch_size,
+        algorithm=request.optimizer,
+        random_seed=request.random_seed,
+        parameters=OPTIMIZATION_PARAMETERS,
+        objective=OPTIMIZATION_OBJECTIVES[0]["name"],
+        goal=OPTIMIZATION_OBJECTIVES[0]["goal"],
+    )
+    print(f"Optimization config {optimization_config}")
+    optimizer = LocalOptimizer(optimization_config)
+    if request.warm_start:
+        for param_values, energy_density in prior_observations(request):
+            optimizer.observe(param_values, energy_density)
+    return optimizer
+
+# every backend returns an object with config.budget, get_new_suggestions() and send_measurements()
+OPTIMIZER_BACKENDS = {
+    "sdlabs": start_sdlabs_optimization,
+    "local": start_local_optimization,
+}
+
+@task(log_prints=True)
+def start_optimization(request:BattmoOptimizationRequest):
+    return OPTIMIZER_BACKENDS[request.backend](request)
+
+def suggestion_to_geometry(suggestion) -> battmo.Geometry1D:
+    return battmo.Geometry1D(
+        NegativeElectrode=battmo.NegativeElectrodeClass(
+            ActiveMaterial=battmo.ActiveMaterialClass(thickness=suggestion.param_values["negative_electrode_thickness"])),
+        PositiveElectrode=battmo.PositiveElectrodeClass(
+            ActiveMaterial=battmo.ActiveMaterialClass(thickness=suggestion.param_values["positive_electrode_thickness"])),
+        Electrolyte=battmo.ElectrolyteClass(
+            Separator=battmo.SeparatorClass(thickness=suggestion.param_values["separator_thickness"]))
+    )
+
+def geometry_to_params(geometry: battmo.Geometry1D) -> Dict[str, float]:
+    return {
+        "negative_electrode_thickness": geometry.NegativeElectrode.ActiveMaterial.thickness,
+        "positive_electrode_thickness": geometry.PositiveElectrode.ActiveMaterial.thickness,
+        "separator_thickness": geometry.Electrolyte.Separator.thickness,
+    }
+
+def cached_results() -> List[Tuple[battmo.Geometry1D, float]]:
+    """(geometry, energy density) of the cached results of the optimized geometry family
+    (default face area), of the current BattMo version and base parameter set, oldest first"""
+    base_parameter_path = os.path.join(battmo.BATTMO_HOME, battmo.BASE_PARAMETER_FILE)
+    version = battmo_version()
+    default_face_area = battmo.Geometry1D().faceArea
+    results = []
+    for entry in sorted(get_cache().entries(), key=lambda entry: entry["created"]):
+        energy_density = entry["result"].get("energyDensity")
+        if energy_density is None or entry["key"] != cache_key(entry["geometry"], base_parameter_path, version):
+            continue
+        geometry = battmo.Geometry1D.parse_obj(entry["geometry"])
+        if geometry.faceArea != default_face_area:
+            continue
+        results.append((geometry, energy_density))
+    return results
+
+def create_surrogate_screen(request: BattmoOptimizationRequest) -> "SurrogateScreen":
+    """Surrogate fitted on all cached simulation results of the optimized geometry family"""
+    from surrogate import SurrogateScreen
+    screen = SurrogateScreen(OPTIMIZATION_PARAMETERS, kappa=request.prescreen_kappa, min_points=request.prescreen_min_points)
+    for geometry, energy_density in cached_results():
+        screen.add(geometry_to_params(geometry), energy_density)
+    print(f"Surrogate screening with {len(screen)} prior results")
+    return screen
+
+def prior_observations(request: BattmoOptimizationRequest) -> List[Tuple[Dict[str, float], float]]:
+    """(param values, energy density) of prior results inside the parameter bounds: the seed_observations
+    of the request and the cached results of the current BattMo version and base parameter set.
+    Duplicates are dropped (the seed_observations win), the best warm_start_max_points are kept."""
+    candidates = [(geometry_to_params(seed.geometry), seed.energy_density) for seed in request.seed_observations]
+    candidates += [(geometry_to_params(geometry), energy_density) for geometry, energy_density in cached_results()]
+    observations = {}
+    for param_values, energy_density in candidates:
+        inside = all(p["low_value"] <= param_values[p["name"]] <= p["high_value"] for p in OPTIMIZATION_PARAMETERS)
+        if inside:
+            observations.setdefault(params_key(param_values), (param_values, float(energy_density)))
+    best = sorted(observations.values(), key=lambda observation: observation[1], reverse=True)
+    best = best[:request.warm_start_max_points]
+    print(f"Warm start with {len(best)} of {len(candidates)} prior results")
+    return best
+
+def evaluate_suggestion(suggestion, prune_below: Optional[float] = None) -> Tuple[battmo.Geometry1D, battmo.PerformanceSpecResponse]:
+    """Simulate a single suggestion, aborted early if it can not reach prune_below.
+    Failures are returned as error response instead of raised"""
+    geometry = suggestion_to_geometry(suggestion)
+    spec_request = battmo.PerformanceSpecRequest(geometry=geometry, prune_below=prune_below, priority="batch")
+    print(f"Sending request {spec_request}")
+    try:
+        response = battmo.simulate_performance_spec(spec_request)
+    except Exception as e:
+        print(f"Simulation {spec_request.uuid} failed: {e}")
+        response = battmo.PerformanceSpecResponse(status=f"error: {e}", uuid=spec_request.uuid, result=battmo.PerformanceSpec())
+    return geometry, response
+
+async def _ask(opt_wrapper, request: BattmoOptimizationRequest, executor, busy) -> list:
+    """Poll the optimizer for new suggestions with exponential backoff and full jitter.
+    Gives up after poll_timeout_s without suggestions, but never while simulations are in flight
+    (the optimizer may wait for their measurements)."""
+    loop = asyncio.get_running_loop()
+    delay = request.poll_initial_s
+    start = loop.time()
+    deadline = start + request.poll_timeout_s
+    poll = metrics.timer("optimizer_ask_seconds", backend=request.backend)(
+        lambda: opt_wrapper.get_new_suggestions(max_retries=1, sleep_time_s=0)
+    )
+    while True:
+        suggestions = await loop.run_in_executor(executor, poll)
+        if suggestions:
+            metrics.observe("optimizer_wait_seconds", loop.time() - start, backend=request.backend)
+            return suggestions
+        if busy():
+            deadline = loop.time() + request.poll_timeout_s
+        elif loop.time() >= deadline:
+            return []
+        await asyncio.sleep(random.uniform(0, delay))
+        delay = min(delay * 2, request.poll_max_s)
+
+async def _optimize(opt_wrapper, request: BattmoOptimizationRequest, checkpoint: Optional[OptimizationCheckpoint] = None) -> List[ExecutedExperiment]:
+    """Ask/tell pipeline: keeps up to max_in_flight suggestions simulating and reports
+    every measurement as soon as its simulation finishes. Completed experiments are logged
+    to the checkpoint. On a restart, backends with observe() (the local optimizer) are told all
+    logged points before the first ask and the run continues after the logged batches. SDLabs
+    can only be told about its own suggestions, logged points it suggests again are replayed
+    without simulation, the others are unknown to it. All logged experiments are part of the result.
+    With prescreen, suggestions the surrogate rules out are reported with their lower confidence bound instead.
+    With early_stop, every simulation is prunable (so the bound and the incumbent share one energy
+    density definition), aborted once it can not beat the incumbent and reported with the energy
+    density it reached, a lower bound of its result"""
+    loop = asyncio.get_running_loop()
+    # optimizer calls are serialized on a single thread, simulations run on their own pool
+    optimizer_executor = ThreadPoolExecutor(max_workers=1)
+    simulation_executor = ThreadPoolExecutor(max_workers=request.parallelism)
+    # suggestions that can not start simulating would only be asked with less information
+    max_in_flight = max(min(request.max_in_flight, request.parallelism), request.batch_size)
+    slots = asyncio.Semaphore(max_in_flight)
+    experiments: List[ExecutedExperiment] = []
+    running = set()
+    tasks = []
+
+    def raise_failed():
+        # errors of tell or of the checkpoint must fail the run, not vanish with the task
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    completed = checkpoint.completed() if checkpoint else {}
+    logged = {key: ExecutedExperiment.parse_raw(entry["experiment"]) for key, entry in completed.items()}
+    replayed = set()
+    first_iteration = 0
+    if completed:
+        print(f"Found {len(completed)} checkpointed experiments")
+    if completed and hasattr(opt_wrapper, "observe"):
+        for entry in completed.values():
+            opt_wrapper.observe(entry["param_values"], entry["measurements"]["energy_density"])
+        # a partly logged batch counts as done
+        first_iteration = min(-(-len(completed) // request.batch_size), opt_wrapper.config.budget)
+        print(f"Told the optimizer {len(completed)} checkpointed experiments, resuming at iteration {first_iteration}")
+    screen = create_surrogate_screen(request) if request.prescreen else None
+    incumbent = [None] # best energy density of this run so far
+    for key, experiment in logged.items():
+        if experiment.spec_response.status == "ok":
+            energy_density = completed[key]["measurements"]["energy_density"]
+            incumbent[0] = energy_density if incumbent[0] is None else max(incumbent[0], energy_density)
+    failures = [0]
+    tell = metrics.timer("optimizer_tell_seconds", backend=request.backend)(opt_wrapper.send_measurements)
+
+    def record(suggestion, measurements: Dict[str, float]):
+        if incumbent[0] is None or measurements["energy_density"] > incumbent[0]:
+            incumbent[0] = measurements["energy_density"]
+        if screen is not None:
+            screen.add(suggestion.param_values, measurements["energy_density"])
+
+    async def skip_and_tell(iteration: int, batch: int, suggestion, decision):
+        try:
+            # the optimizer (e.g. SDLabs) waits for a measurement of every suggestion. It gets the lower
+            # confidence bound, a pessimistic value below the incumbent, the prediction itself would
+            # enter its data as if it had been measured
+            experiment = ExecutedExperiment(
+                geometry=suggestion_to_geometry(suggestion),
+                spec_response=battmo.PerformanceSpecResponse(status="skipped", uuid=uuid4(), result=battmo.PerformanceSpec()),
+                batch=batch,
+                iteration=iteration,
+                simulated=False,
+                predicted_energy_density=decision.predicted,
+                predicted_upper_bound=decision.upper_bound,
+            )
+            print(f"Skipping suggestion {suggestion}, predicted upper bound {decision.upper_bound} < {incumbent[0]}")
+            experiments.append(experiment)
+            metrics.inc("optimizer_suggestions_total", outcome="skipped")
+            measurements = {"energy_density": decision.lower_bound}
+            if checkpoint:
+                checkpoint.append(suggestion.param_values, measurements, experiment.json())
+            suggestion.measurements = measurements
+            await loop.run_in_executor(optimizer_executor, tell, [suggestion])
+        finally:
+            slots.release()
+
+    async def simulate_and_tell(iteration: int, batch: int, suggestion):
+        try:
+            key = params_key(suggestion.param_values)
+            if key in completed:
+                # completed before a restart, replay into the optimizer instead of simulating again
+                replayed.add(key)
+                experiment = logged[key].copy()
+                experiment.batch, experiment.iteration = batch, iteration
+                measurements = completed[key]["measurements"]
+                print(f"Replaying checkpointed experiment {experiment}")
+                metrics.inc("optimizer_suggestions_total", outcome="replayed")
+            else:
+                prune_below = None
+                if request.early_stop:
+                    prune_below = -math.inf if incumbent[0] is None else incumbent[0]
+                geometry, response = await loop.run_in_executor(simulation_executor, evaluate_suggestion, suggestion, prune_below)
+                print(f"Obtained response {response}")
+                experiment = ExecutedExperiment(geometry=geometry,spec_response=response,batch=batch,iteration=iteration)
+                outcome = {"ok": "simulated", "pruned": "pruned"}.get(response.status, "failed")
+                metrics.inc("optimizer_suggestions_total", outcome=outcome)
+                if outcome == "failed":
+                    experiments.append(experiment)
+                    failures[0] += 1
+                    if failures[0] >= request.max_failures:
+                        # the optimizer (e.g. SDLabs) may wait for the missing measurements
+                        raise RuntimeError(f"{failures[0]} simulations failed, aborting the optimization: {response.status}")
+                    return
+                if outcome == "pruned":
+                    # the upper bound would make the point look better than it is, the energy density
+                    # reached before the abort is at most its result
+                    print(f"Pruned suggestion {suggestion}, upper bound {response.result.energyDensityUpperBound} < {prune_below}")
+                    measurements = {"energy_density": float(response.result.energyDensityLowerBound)}
+                else:
+                    measurements = {
+                    # get energy density from PerformanceSpecResponse
+                    "energy_density": float(response.result.energyDensity),
+                    }
+                if checkpoint:
+                    checkpoint.append(suggestion.param_values, measurements, experiment.json())
+            experiments.append(experiment)
+            if experiment.spec_response.status == "ok":
+                record(suggestion, measurements)
+            suggestion.measurements = measurements
+            print(f"Sending measurement {suggestion} back to the optimizer")
+            await loop.run_in_executor(optimizer_executor, tell, [suggestion])
+        finally:
+            slots.release()
+
+    async def queued(step):
+        # waits outside of the ask loop, which must not block on slots only queued suggestions would release
+        await slots.acquire()
+        await step()
+
+    try:
+        for iteration in range(first_iteration, opt_wrapper.config.budget):
+            # reserve room for a full batch before asking
+            for _ in range(request.batch_size):
+                await slots.acquire()
+            raise_failed()
+            print("Getting new suggestions...")
+            suggestions = await _ask(opt_wrapper, request, optimizer_executor, lambda: bool(running))
+            print(f"Suggestions found: {suggestions}")
+            for _ in range(request.batch_size - len(suggestions)):
+                slots.release()
+            decisions = screen.screen([suggestion.param_values for suggestion in suggestions], incumbent[0]) if screen is not None else None
+            for batch, suggestion in enumerate(suggestions):
+                if decisions and not decisions[batch].simulate and params_key(suggestion.param_values) not in completed:
+                    step = functools.partial(skip_and_tell, iteration, batch, suggestion, decisions[batch])
+                else:
+                    step = functools.partial(simulate_and_tell, iteration, batch, suggestion)
+                # more suggestions than reserved (e.g. SDLabs re-issuing unmeasured ones) queue for a slot
+                task = asyncio.ensure_future(step() if batch < request.batch_size else queued(step))
+                running.add(task)
+                tasks.append(task)
+                task.add_done_callback(running.discard)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for error in errors:
+            print(f"Optimization step failed: {error!r}")
+        if errors:
+            raise errors[0]
+    finally:
+        simulation_executor.shutdown(wait=False)
+        optimizer_executor.shutdown(wait=False)
+    # logged experiments that were not suggested again, a resumed run keeps its incumbent
+    experiments += [experiment for key, experiment in logged.items() if key not in replayed]
+    experiments.sort(key=lambda experiment: (experiment.iteration, experiment.batch))
+    return experiments
+
+def _run_async(coroutine):
+    """Run a coroutine from sync code, also if the calling thread already runs an event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
 @flow(log_prints=True)
 def run_geometry_optimization(request: BattmoOptimizationRequest=BattmoOptimizationRequest()):
     """Create a fixed optimization config that will optimize for the thickness parameters
-    At every iteration call SDLabs to get a new suggestion and use this suggestion in the performance spec calculation"""
+    Ask the optimizer backend (SDLabs by default) for suggestions and use them in the performance spec calculation.
+    Asking, simulating and reporting measurements overlap, see _optimize"""
     
-    opt_wrapper = start_optimization(request)
-    print("Initialized optimization")
+    checkpoint = None
+    if request.resume:
+        checkpoint = OptimizationCheckpoint(request.uuid)
+        stored = checkpoint.load_request()
+        if stored:
+            # restore the settings that determine the suggestions, so they are suggested (and replayed) again
+            stored = json.loads(stored)
+            request = request.copy(update={key: stored[key] for key in RESUME_FIELDS if key in stored})
+            print(f"Resuming optimization {request.uuid}")
+        else:
+            checkpoint.save_request(request.json())
     
-    experiments: List[ExecutedExperiment] = []
+    with FlowMetrics("run_geometry_optimization") as flow_metrics:
+        opt_wrapper = start_optimization(request)
+        print("Initialized optimization")
+        
+        try:
+            experiments = _run_async(_optimize(opt_wrapper, request, checkpoint))
+        finally:
+            if checkpoint:
+                checkpoint.close()
     best_experiment:ExecutedExperiment = None
-    for iteration in range(opt_wrapper.config.budget):
-        print("Getting new suggestions...")
-        suggestions = opt_wrapper.get_new_suggestions(max_retries=6, sleep_time_s=30)
-        print(f"Suggestions found: {suggestions}")
-        for batch,suggestion in enumerate(suggestions):
-            # Create performance spec request
-            print("Creating geometry")
-            geometry = battmo.Geometry1D(
-                NegativeElectrode=battmo.NegativeElectrodeClass(
-                    ActiveMaterial=battmo.ActiveMaterialClass(thickness=suggestion.param_values["negative_electrode_thickness"])),
-                PositiveElectrode=battmo.PositiveElectrodeClass(
-                    ActiveMaterial=battmo.ActiveMaterialClass(thickness=suggestion.param_values["positive_electrode_thickness"])),
-                Electrolyte=battmo.ElectrolyteClass(
-                    Separator=battmo.SeparatorClass(thickness=suggestion.param_values["separator_thickness"]))
-            )
-            request = battmo.PerformanceSpecRequest(geometry=geometry)
-            print(f"Sending request {request}")
-            # call performance spec flow
-            response:battmo.PerformanceSpecResponse = battmo.run_performance_spec(request)
-            print(f"Obtained response {response}")
-            suggestion.measurements = {
-            # get energy density from PerformanceSpecResponse
-            "energy_density": float(response.result.energyDensity),
-            }
-            print(suggestion)
-            experiment = ExecutedExperiment(geometry=geometry,spec_response=response)
-            if not best_experiment or experiment.spec_response.result.energyDensity > best_experiment.spec_response.result.energyDensity:
-                best_experiment = experiment
-                print(f"New best experiment {best_experiment}")
-            experiments.append(experiment)
-        if suggestions:
-            print("Sending response back to sdlabs")
-            opt_wrapper.send_measurements(suggestions)
-    optimization_result = BattmoOptimizationResult(experiments=experiments,best_run=best_experiment)
+    for experiment in experiments:
+        if experiment.spec_response.status != "ok":
+            continue
+        if not best_experiment or experiment.spec_response.result.energyDensity > best_experiment.spec_response.result.energyDensity:
+            best_experiment = experiment
+    if best_experiment is None:
+        raise RuntimeError(f"Optimization {request.uuid} has no successful simulation out of {len(experiments)} experiments")
+    print(f"Best experiment {best_experiment}")
+    optimization_result = BattmoOptimizationResult(uuid=request.uuid,experiments=experiments,best_run=best_experiment,metrics=flow_metrics.summary)
     return optimization_result
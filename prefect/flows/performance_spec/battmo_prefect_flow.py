@@ -6,17 +6,29 @@ from prefect import flow, task
 from pydantic import BaseModel, Field
 from uuid import UUID, uuid4
 #from loguru import logger
-from typing import Union, Optional
+from typing import Union, Optional, List, Tuple, Dict, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
 
 
 import copy
 
-from oct2py import octave
+from octave_pool import get_pool, BATTMO_HOME
+from admission import get_controller
+from result_cache import get_cache, cache_key
+from metrics import FlowMetrics
+import metrics
+# numpy and the trajectory store are imported on first use, importing the flow module
+# (e.g. to build deployments) neither loads numpy nor starts octave
+if TYPE_CHECKING:
+    import numpy as np
 import os
 import fnmatch
 import json
+import math
 
 
+# base parameter set, relative to BATTMO_HOME
+BASE_PARAMETER_FILE = 'ParameterData/BatteryCellParameters/LithiumIonBatteryCell/lithium_ion_battery_nmc_graphite.json'
 
 class TestRequest(BaseModel):
     text: str
@@ -47,34 +59,229 @@ class PerformanceSpec(BaseModel):
     E: Optional[float]
     energyDensity: Optional[float]
     energy: Optional[float]
+    energyDensityUpperBound: Optional[float] # pruned runs only, bound of the final energy density
+    energyDensityLowerBound: Optional[float] # pruned runs only, energy density reached before the abort
     
 class PerformanceSpecRequest(BaseModel):
     geometry: Optional[Geometry1D] = Geometry1D()
     uuid: UUID = Field(default_factory=uuid4, title="UUID")
+    use_cache: Optional[bool] = True
+    write_files: Optional[bool] = False # write BattMo input and output json files (in memory otherwise)
+    priority: Optional[str] = Field("interactive", regex="^(interactive|batch)$") # admission priority, see admission.py
+    prune_below: Optional[float] = None # abort the run (status "pruned") once its energy density can no longer reach this value (-inf: never), ignored with write_files.
+    # The energy density of these runs is computed from the simulated steps, not by runBatteryJson, they are cached separately
     
 class PerformanceSpecResponse(BaseModel):
     status: Optional[str] = "ok"
     uuid: UUID
     result: PerformanceSpec
+    trajectory: Optional[str] = None # .npy file with the full time series, see trajectory_store.TrajectoryStore.load
+    metrics: Optional[Dict] = None # stage timings and counts of the flow run, see metrics.FlowMetrics
 
-@flow
-def run_performance_spec(request: PerformanceSpecRequest):
-    octave.run('/home/jovyan/BattMo/startupBattMo.m')
-    
-    print(request.geometry.json())
-    
-    battmo_input = f'/home/jovyan/BattMo/Examples/experiment/optimization_test/input_json/{str(request.uuid)}.json'
-    battmo_output = f'/home/jovyan/BattMo/Examples/experiment/optimization_test/output_json/{str(request.uuid)}.json' 
+class PerformanceSpecBatchResponse(BaseModel):
+    """Columnar results of a batch, entry i of every list belongs to uuid[i]"""
+    uuid: List[UUID]
+    status: List[str]
+    E: List[Optional[float]]
+    energyDensity: List[Optional[float]]
+    energy: List[Optional[float]]
+    trajectory: List[Optional[str]]
+    energyDensityUpperBound: Optional[List[Optional[float]]] = None # set if any request had prune_below
+    energyDensityLowerBound: Optional[List[Optional[float]]] = None # set if any request had prune_below
+    metrics: Optional[Dict] = None
+
+    def response(self, uuid: UUID) -> PerformanceSpecResponse:
+        i = self.uuid.index(uuid)
+        upper = self.energyDensityUpperBound[i] if self.energyDensityUpperBound else None
+        lower = self.energyDensityLowerBound[i] if self.energyDensityLowerBound else None
+        return PerformanceSpecResponse(
+            status=self.status[i],
+            uuid=uuid,
+            result=PerformanceSpec(
+                E=self.E[i], energyDensity=self.energyDensity[i], energy=self.energy[i],
+                energyDensityUpperBound=upper, energyDensityLowerBound=lower,
+            ),
+            trajectory=self.trajectory[i]
+        )
+
+    def responses(self) -> List[PerformanceSpecResponse]:
+        return [self.response(uuid) for uuid in self.uuid]
+
+# (status, final values, full time series) of a single simulation
+SimulationOutcome = Tuple[str, PerformanceSpec, Dict[str, "np.ndarray"]]
+
+def _cells(value) -> list:
+    """Flatten a cell array returned by oct2py into a list"""
+    import numpy as np
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, np.ndarray) and value.dtype == object:
+        return value.ravel().tolist()
+    return [value]
+
+def _last(series) -> Optional[float]:
+    import numpy as np
+    values = np.asarray(series, dtype=float).ravel()
+    return float(values[-1]) if values.size else None
+
+def _outcome(status: str, E, energyDensity, energy, upperBound=None) -> SimulationOutcome:
+    if status == "pruned":
+        # the partial series are of no use, only the bounds are reported. The energy reached so far
+        # only grows during the discharge, a lower bound of the final energy density
+        return status, PerformanceSpec(energyDensityUpperBound=_last(upperBound), energyDensityLowerBound=_last(energyDensity)), {}
+    series = {"E": E, "energyDensity": energyDensity, "energy": energy}
+    spec = PerformanceSpec(**{name: _last(values) for name, values in series.items()})
+    return status, spec, series
+
+def _priority(requests: List[PerformanceSpecRequest]) -> str:
+    """A chunk is interactive if any of its requests is"""
+    return "interactive" if any(request.priority == "interactive" for request in requests) else "batch"
+
+def _simulate_chunk(requests: List[PerformanceSpecRequest]) -> List[SimulationOutcome]:
+    """Simulate several geometries in a single octave call, geometries are passed in memory.
+    Requests with prune_below are checked against their threshold after every step."""
+    geometries = [request.geometry.json() for request in requests]
+    metrics.observe("battmo_simulation_batch_size", len(geometries))
+    metrics.observe("battmo_input_bytes", sum(len(geometry) for geometry in geometries))
+    thresholds = [request.prune_below for request in requests]
+    upperBound = [None] * len(requests)
+    with get_controller().admit(_priority(requests)), get_pool().lease() as octave:
+        with metrics.timer("battmo_octave_call_seconds", function="runJsonFunctionBatch"):
+            if any(threshold is not None for threshold in thresholds):
+                thresholds = [math.nan if threshold is None else threshold for threshold in thresholds]
+                E, energyDensity, energy, status, upperBound = octave.runJsonFunctionBatch(
+                    BASE_PARAMETER_FILE, geometries, thresholds, nout=5
+                )
+            else:
+                E, energyDensity, energy, status = octave.runJsonFunctionBatch(BASE_PARAMETER_FILE, geometries, nout=4)
+    E, energyDensity, energy, status, upperBound = _cells(E), _cells(energyDensity), _cells(energy), _cells(status), _cells(upperBound)
+    outcomes = [_outcome(str(status[i]), E[i], energyDensity[i], energy[i], upperBound[i]) for i in range(len(requests))]
+    metrics.inc("battmo_simulations_pruned_total", sum(1 for outcome in outcomes if outcome[0] == "pruned"))
+    return outcomes
+
+def _simulate_with_files(request: PerformanceSpecRequest) -> SimulationOutcome:
+    """Simulate via BattMo input and output json files, kept for inspection"""
+    battmo_input = f'{BATTMO_HOME}/Examples/experiment/optimization_test/input_json/{str(request.uuid)}.json'
+    battmo_output = f'{BATTMO_HOME}/Examples/experiment/optimization_test/output_json/{str(request.uuid)}.json' 
     
-    f = open(battmo_input, "w")
-    f.write(request.geometry.json())
-    f.close()
+    with metrics.timer("battmo_write_input_seconds"):
+        f = open(battmo_input, "w")
+        f.write(request.geometry.json())
+        f.close()
         
     # run the simulation
     battmo_input = f'Examples/experiment/optimization_test/input_json/{str(request.uuid)}.json'
-    E, energyDensity, energy = octave.runJsonFunction({'ParameterData/BatteryCellParameters/LithiumIonBatteryCell/lithium_ion_battery_nmc_graphite.json', battmo_input}, battmo_output, nout=3)
-    response = PerformanceSpecResponse(
-        uuid=request.uuid,
-        result=PerformanceSpec(E = E[:,0][-1], energyDensity = energyDensity[:,0][-1], energy = energy[:,0][-1])
+    # lease a warm octave session (BattMo startup already done) from the worker pool
+    with get_controller().admit(request.priority), get_pool().lease() as octave:
+        with metrics.timer("battmo_octave_call_seconds", function="runJsonFunction"):
+            E, energyDensity, energy = octave.runJsonFunction({BASE_PARAMETER_FILE, battmo_input}, battmo_output, nout=3)
+    return _outcome("ok", E[:,0], energyDensity[:,0], energy[:,0])
+
+def _store_outcome(key: str, request: PerformanceSpecRequest, outcome: SimulationOutcome) -> Optional[str]:
+    """Store the trajectory of a successful simulation and cache its result, returns the trajectory path.
+    Pruned runs are not cached, their outcome depends on the threshold of the request."""
+    from trajectory_store import get_trajectory_store, TRAJECTORY_FIELDS
+    status, spec, series = outcome
+    if status != "ok":
+        return None
+    trajectory = get_trajectory_store().save(key, {name: series[name] for name in TRAJECTORY_FIELDS})
+    metrics.observe("battmo_trajectory_bytes", os.path.getsize(trajectory))
+    get_cache().put(key, request.geometry.dict(), dict(spec.dict(), trajectory=trajectory))
+    return trajectory
+
+def _cache_key(request: PerformanceSpecRequest, base_parameter_path: str) -> str:
+    """Prunable runs compute their energy density from the simulated steps (see runJsonFunctionBatch.m),
+    not with the definition of runBatteryJson, their results are kept apart from the full runs"""
+    return cache_key(request.geometry.dict(), base_parameter_path, variant=None if request.prune_below is None else "stepwise")
+
+def _cached_response(cached: Dict, uuid: UUID) -> PerformanceSpecResponse:
+    trajectory = cached.get("trajectory")
+    if trajectory and not os.path.exists(trajectory):
+        trajectory = None
+    return PerformanceSpecResponse(uuid=uuid, result=PerformanceSpec(**cached), trajectory=trajectory)
+
+def simulate_performance_spec(request: PerformanceSpecRequest) -> PerformanceSpecResponse:
+    """Run a single simulation outside of a flow run, e.g. from worker threads"""
+    print(request.geometry.json())
+    
+    cache = get_cache()
+    key = _cache_key(request, os.path.join(BATTMO_HOME, BASE_PARAMETER_FILE))
+    if request.use_cache:
+        cached = cache.get(key)
+        metrics.inc("battmo_cache_requests_total", result="miss" if cached is None else "hit")
+        if cached is not None:
+            print(f"Cache hit {key}, cache stats: {cache.stats()}")
+            return _cached_response(cached, request.uuid)
+    
+    if request.write_files:
+        outcome = _simulate_with_files(request)
+    else:
+        outcome = _simulate_chunk([request])[0]
+    status, spec, _ = outcome
+    if status not in ("ok", "pruned"):
+        raise RuntimeError(f"Simulation {request.uuid} failed: {status}")
+    return PerformanceSpecResponse(status=status, uuid=request.uuid, result=spec, trajectory=_store_outcome(key, request, outcome))
+
+@flow
+def run_performance_spec(request: PerformanceSpecRequest):
+    with FlowMetrics("run_performance_spec") as flow_metrics:
+        response = simulate_performance_spec(request)
+    response.metrics = flow_metrics.summary
+    return response
+
+def simulate_performance_spec_batch(
+    requests: List[PerformanceSpecRequest], chunk_size: Optional[int] = None, max_workers: int = 1
+) -> PerformanceSpecBatchResponse:
+    """Simulate many geometries with one octave call per chunk (default: a single chunk).
+    Chunks are distributed over up to max_workers octave workers."""
+    cache = get_cache()
+    base_parameter_path = os.path.join(BATTMO_HOME, BASE_PARAMETER_FILE)
+    keys = [_cache_key(request, base_parameter_path) for request in requests]
+    responses: List[Optional[PerformanceSpecResponse]] = [None] * len(requests)
+    pending = []
+    for i, request in enumerate(requests):
+        cached = cache.get(keys[i]) if request.use_cache else None
+        if request.use_cache:
+            metrics.inc("battmo_cache_requests_total", result="miss" if cached is None else "hit")
+        if cached is not None:
+            responses[i] = _cached_response(cached, request.uuid)
+        else:
+            pending.append(i)
+    print(f"Batch of {len(requests)} geometries, {len(requests) - len(pending)} cached")
+
+    chunk_size = chunk_size or len(pending) or 1
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+    def run(chunk) -> List[SimulationOutcome]:
+        try:
+            return _simulate_chunk([requests[i] for i in chunk])
+        except Exception as e:
+            print(f"Batch simulation failed: {e}")
+            return [(f"error: {e}", PerformanceSpec(), {})] * len(chunk)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        for chunk, outcomes in zip(chunks, executor.map(run, chunks)):
+            for i, outcome in zip(chunk, outcomes):
+                status, spec, _ = outcome
+                responses[i] = PerformanceSpecResponse(
+                    status=status, uuid=requests[i].uuid, result=spec, trajectory=_store_outcome(keys[i], requests[i], outcome)
+                )
+
+    pruning = any(request.prune_below is not None for request in requests)
+    return PerformanceSpecBatchResponse(
+        uuid=[response.uuid for response in responses],
+        status=[response.status for response in responses],
+        E=[response.result.E for response in responses],
+        energyDensity=[response.result.energyDensity for response in responses],
+        energy=[response.result.energy for response in responses],
+        trajectory=[response.trajectory for response in responses],
+        energyDensityUpperBound=[response.result.energyDensityUpperBound for response in responses] if pruning else None,
+        energyDensityLowerBound=[response.result.energyDensityLowerBound for response in responses] if pruning else None,
     )
-    return response
\ No newline at end of file
+
+@flow
+def run_performance_spec_batch(requests: List[PerformanceSpecRequest], chunk_size: Optional[int] = None, max_workers: int = 1):
+    with FlowMetrics("run_performance_spec_batch") as flow_metrics:
+        response = simulate_performance_spec_batch(requests, chunk_size=chunk_size, max_workers=max_workers)
+    response.metrics = flow_metrics.summary
+    return response
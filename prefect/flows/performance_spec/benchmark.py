@@ -0,0 +1,568 @@
+# Offline benchmarks of the flows with deterministic local stand-ins for the external services:
+#   FakeOctavePool   BattMo stand-in with configurable startup/simulation latency and an analytic
+#                    energy density (smooth, with an optimum inside the optimization bounds)
+#   InMemoryOsw      OSW page store (load_entity/store_entity) with configurable latency
+#   FakeSdlabs       optimizer backend with network latency, wraps the local optimizer
+#   FakeArchive      local HTTP server with the subset of the Zenodo and InvenioRDM (BIG-MAP
+#                    Archive) REST APIs used for publishing
+# Every scenario runs at increasing request counts and reports throughput, latency percentiles
+# and memory, so every performance change gets a number. Caches and checkpoints go to a
+# temporary directory, nothing touches the real services or ~/.cache.
+#
+# usage: python benchmark.py [--counts 1 10 100] [--scenarios import performance_spec ...]
+#                            [--latency 0.05] [--workers 4] [--json results.json]
+# The import scenario measures the import time of the flow modules in a fresh interpreter
+# (after prefect itself is imported) and fails if it exceeds --import-budget-s, the same check
+# runs standalone (CI, deploy_flow.sh) with check_imports.py.
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+FLOWS_DIR = os.path.dirname(os.path.abspath(__file__))
+FLOW_MODULES = ["battmo_prefect_flow", "atinary_prefect_flow", "sweep_prefect_flow", "osw_prefect_flow"]
+# modules that must not be loaded by importing a flow module, except the allowed ones: the sweep is
+# built on numpy, the OSW flow declares its pydantic models on the OSW entity classes at module level
+HEAVY_MODULES = ["numpy", "oct2py", "sdlabs_wrapper", "zenodo_client", "big_map_archive_api", "osw"]
+ALLOWED_HEAVY_MODULES = {"sweep_prefect_flow": ["numpy"], "osw_prefect_flow": ["osw"]}
+SCENARIOS = ["import", "performance_spec", "performance_spec_batch", "optimization", "schedule_simulations", "publish"]
+
+
+def energy_density(negative: float, positive: float, separator: float) -> float:
+    """Analytic stand-in for the BattMo energy density [Wh/L]: the smaller (capacity balanced)
+    electrode limits the capacity, all layers add volume"""
+    capacity = min(negative, 1.2 * positive)
+    return 1.0e3 * capacity / (negative + positive + separator + 40e-6) * (1.0 - 2.0e3 * separator)
+
+
+# --- Octave -----------------------------------------------------------------------------------
+
+class FakeOctave:
+    """Octave session with the functions called by battmo_prefect_flow"""
+
+    def __init__(self, latency_s: float, steps: int = 100):
+        self.latency_s = latency_s
+        self.steps = steps
+
+    def _simulate(self, geometry: Dict):
+        ed = energy_density(
+            geometry["NegativeElectrode"]["ActiveMaterial"]["thickness"],
+            geometry["PositiveElectrode"]["ActiveMaterial"]["thickness"],
+            geometry["Electrolyte"]["Separator"]["thickness"],
+        )
+        ramp = np.linspace(0.0, 1.0, self.steps).reshape(-1, 1)
+        return 4.2 - 1.2 * ramp, ed * ramp, ed * geometry["faceArea"] * ramp
+
+    def runJsonFunctionBatch(self, base_file, geometries, prune_below=None, nout=4):
+        E, energy_density, energy, status, upper_bound = [], [], [], [], []
+        for i, geometry in enumerate(geometries):
+            e, ed, en = self._simulate(json.loads(geometry))
+            # bound: energy so far plus the remaining capacity at the initial voltage
+            bound = ed[:, 0] + (ed[-1, 0] - ed[:, 0]) * e[0, 0] / e[:, 0].mean()
+            threshold = np.nan if prune_below is None else prune_below[i]
+            below = np.flatnonzero(bound < threshold)
+            steps = below[0] + 1 if below.size else self.steps
+            time.sleep(self.latency_s * steps / self.steps)
+            E.append(e[:steps])
+            energy_density.append(ed[:steps])
+            energy.append(en[:steps])
+            status.append("pruned" if below.size else "ok")
+            upper_bound.append(float(bound[steps - 1]) if below.size else None)
+        return (E, energy_density, energy, status, upper_bound)[:nout]
+
+    def runJsonFunction(self, files, output_file, nout=3):
+        input_file = [f for f in files if "input_json" in f][0]
+        with open(os.path.join(os.environ["BATTMO_HOME"], input_file), encoding="utf-8") as f:
+            geometry = json.load(f)
+        time.sleep(self.latency_s)
+        return self._simulate(geometry)
+
+
+def install_octave(latency_s: float, startup_s: float, workers: int):
+    import admission
+    import octave_pool
+
+    class FakeOctaveWorker(octave_pool.OctaveWorker):
+        def __init__(self, startup_script=None):
+            time.sleep(startup_s)
+            self.session = FakeOctave(latency_s)
+            self.jobs = 0
+            self.started_at = time.time()
+
+        def alive(self) -> bool:
+            return True
+
+        def close(self):
+            pass
+
+    class FakeOctavePool(octave_pool.OctaveWorkerPool):
+        def _new_worker(self):
+            return FakeOctaveWorker()
+
+    octave_pool._pool = FakeOctavePool(size=workers, max_jobs=0, max_rss_mb=0)
+    # admit as many simulations as there are fake workers, independent of the cores of this machine
+    admission._controller = admission.AdmissionController(cores=workers)
+
+
+# --- OSW --------------------------------------------------------------------------------------
+
+class InMemoryOsw:
+    """Page store with the OSW methods used by the flows, entities are stored as json"""
+
+    def __init__(self, entity_class, latency_s: float = 0.0):
+        self.entity_class = entity_class
+        self.latency_s = latency_s
+        self.pages: Dict[str, str] = {}
+        self.loads = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+
+    def get_osw_id(self, entity_uuid) -> str:
+        return "OSW" + str(entity_uuid).replace("-", "")
+
+    def load_entity(self, title: str):
+        time.sleep(self.latency_s)
+        with self._lock:
+            self.loads += 1
+            return self.entity_class.parse_raw(self.pages[title])
+
+    def store_entity(self, entity):
+        time.sleep(self.latency_s)
+        with self._lock:
+            self.stores += 1
+            self.pages["Item:" + self.get_osw_id(entity.uuid)] = entity.json(exclude_none=True)
+
+
+class FakeConnection:
+    def __init__(self, osw: InMemoryOsw, domain: str = "benchmark.local"):
+        self.osw = osw
+        self.wtsite = None
+        self.domain = domain
+
+
+def create_models(osw_module, osw: InMemoryOsw, n: int, runs_per_model: int = 1) -> List[str]:
+    """n BattmoModel pages with pending simulation runs, returns their titles"""
+    model = osw_module.model
+    rng = random.Random(f"models-{n}")
+    titles = []
+    for i in range(n):
+        entity = model.BattmoModel.parse_obj({
+            "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+            "type": [osw_module.BATTMO_MODEL_CATEGORY],
+            "label": [{"text": f"Benchmark model {i}"}],
+            "geometry": _random_geometry(rng).dict(),
+            "workflow_runs": [
+                {"uuid": str(uuid.UUID(int=rng.getrandbits(128))), "status": osw_module.TODO_STATUS, "tool": [osw_module.BATTMO_SIMULATION_TOOL]}
+                for _ in range(runs_per_model)
+            ],
+        })
+        osw.store_entity(entity)
+        titles.append("Item:" + osw.get_osw_id(entity.uuid))
+    osw.stores = 0
+    return titles
+
+
+# --- SDLabs -----------------------------------------------------------------------------------
+
+class FakeSdlabs:
+    """SDLabs stand-in: local optimizer behind a network round-trip per call"""
+
+    def __init__(self, optimizer, latency_s: float):
+        self.optimizer = optimizer
+        self.config = optimizer.config
+        self.latency_s = latency_s
+
+    def get_new_suggestions(self, max_retries: int = 10, sleep_time_s: float = 5):
+        time.sleep(self.latency_s)
+        return self.optimizer.get_new_suggestions(max_retries=max_retries, sleep_time_s=sleep_time_s)
+
+    def send_measurements(self, suggestions):
+        time.sleep(self.latency_s)
+        return self.optimizer.send_measurements(suggestions)
+
+
+def install_sdlabs(latency_s: float):
+    import atinary_prefect_flow
+
+    def start(request):
+        return FakeSdlabs(atinary_prefect_flow.start_local_optimization(request), latency_s)
+
+    atinary_prefect_flow.OPTIMIZER_BACKENDS["sdlabs"] = start
+
+
+# --- Archive ----------------------------------------------------------------------------------
+
+class FakeArchive:
+    """Local HTTP server implementing the Zenodo deposition API (/api/deposit/depositions) and
+    the InvenioRDM records API (/api/records) far enough for create, new version, upload, publish"""
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.requests = 0
+        self.bytes_received = 0
+        self.published = 0
+        self._ids = iter(range(1, 10**9))
+        self._submitted: Dict[int, bool] = {} # Zenodo depositions, published or draft
+        self._concepts: Dict[int, int] = {} # deposition id -> id of its first version
+        self._lock = threading.Lock()
+        archive = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: Dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                time.sleep(archive.latency_s)
+                with archive._lock:
+                    archive.requests += 1
+                    archive.bytes_received += length
+                status, reply = archive.route(self.command, self.path.split("?")[0], body)
+                self._reply(status, reply)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _next_id(self) -> int:
+        with self._lock:
+            return next(self._ids)
+
+    def _open_draft(self, i: int) -> Optional[int]:
+        """Unpublished version of the record of deposition i, called with the lock held"""
+        concept = self._concepts[i]
+        return next((j for j, c in self._concepts.items() if c == concept and not self._submitted[j]), None)
+
+    def route(self, method: str, path: str, body: bytes):
+        parts = path.strip("/").split("/")
+        base = self.url
+        def deposition(i) -> Dict:
+            draft = self._open_draft(i)
+            links = {
+                "self": f"{base}/api/deposit/depositions/{i}",
+                "bucket": f"{base}/api/files/{i}",
+                "publish": f"{base}/api/deposit/depositions/{i}/actions/publish",
+                "html": f"{base}/deposit/{i}",
+            }
+            if draft is not None:
+                links["latest_draft"] = f"{base}/api/deposit/depositions/{draft}"
+            return {
+                "id": i,
+                "submitted": self._submitted[i],
+                "metadata": {"prereserve_doi": {"doi": f"10.5072/zenodo.{i}"}},
+                "files": [{"filename": "previous.json", "links": {"self": f"{base}/api/deposit/depositions/{i}/files/1"}}],
+                "links": links,
+            }
+
+        if parts[:3] == ["api", "deposit", "depositions"]:
+            with self._lock:
+                if len(parts) > 3 and int(parts[3]) not in self._submitted:
+                    return 404, {"message": f"deposition {parts[3]} not found"}
+                if method == "POST" and len(parts) == 3:
+                    i = next(self._ids)
+                    self._submitted[i], self._concepts[i] = False, i
+                    return 201, dict(deposition(i), files=[])
+                if method in ("GET", "PUT") and len(parts) == 4:
+                    return 200, deposition(int(parts[3]))
+                if method == "DELETE" and parts[-2] == "files":
+                    return 200, {}
+                if method == "POST" and parts[-1] == "newversion":
+                    i = int(parts[3])
+                    if self._open_draft(i) is not None:
+                        # like Zenodo: one open draft per record
+                        return 400, {"message": "Please remove all files first or publish the existing draft"}
+                    j = next(self._ids)
+                    self._submitted[j], self._concepts[j] = False, self._concepts[i]
+                    return 201, deposition(i)
+                if method == "POST" and parts[-1] == "publish":
+                    self._submitted[int(parts[3])] = True
+                    self.published += 1
+                    return 202, {"id": int(parts[3]), "doi": f"10.5072/zenodo.{parts[3]}", "links": {"record_html": f"{base}/record/{parts[3]}"}}
+        if parts[:2] == ["api", "files"] and method == "PUT":
+            return 201, {"key": parts[-1]}
+        if parts[:2] == ["api", "records"]:
+            if method == "POST" and len(parts) == 2:
+                i = str(self._next_id())
+                draft = f"{base}/api/records/{i}/draft"
+                return 201, {"id": i, "links": {"self": draft, "files": f"{draft}/files", "publish": f"{draft}/actions/publish", "self_html": f"{base}/uploads/{i}"}}
+            if method == "POST" and parts[-1] == "files":
+                draft = "/".join([base] + parts[:-1])
+                keys = [entry["key"] for entry in json.loads(body or b"[]")]
+                return 201, {"entries": [
+                    {"key": key, "links": {"content": f"{draft}/files/{key}/content", "commit": f"{draft}/files/{key}/commit"}}
+                    for key in keys
+                ]}
+            if parts[-1] in ("content", "commit"):
+                return 200, {"status": "completed"}
+            if method == "POST" and parts[-1] == "publish":
+                with self._lock:
+                    self.published += 1
+                return 202, {"id": parts[2], "links": {"self_html": f"{base}/records/{parts[2]}"}}
+        return 404, {"message": f"{method} {path} not supported"}
+
+    def close(self):
+        self.server.shutdown()
+
+
+# --- scenarios --------------------------------------------------------------------------------
+
+def _random_geometry(rng: random.Random):
+    import battmo_prefect_flow as battmo
+
+    return battmo.Geometry1D(
+        NegativeElectrode=battmo.NegativeElectrodeClass(ActiveMaterial=battmo.ActiveMaterialClass(thickness=rng.uniform(30e-6, 150e-6))),
+        PositiveElectrode=battmo.PositiveElectrodeClass(ActiveMaterial=battmo.ActiveMaterialClass(thickness=rng.uniform(30e-6, 150e-6))),
+        Electrolyte=battmo.ElectrolyteClass(Separator=battmo.SeparatorClass(thickness=rng.uniform(8e-6, 15e-6))),
+    )
+
+
+def _timed_map(function: Callable, items: list, workers: int) -> List[float]:
+    """Latency of function(item) for every item, with up to workers calls at the same time"""
+    def run(item):
+        start = time.perf_counter()
+        function(item)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(run, items))
+
+
+def scenario_performance_spec(n: int, args) -> Dict:
+    import battmo_prefect_flow as battmo
+
+    rng = random.Random(f"performance_spec-{n}")
+    requests = [battmo.PerformanceSpecRequest(geometry=_random_geometry(rng)) for _ in range(n)]
+    latencies = _timed_map(battmo.run_performance_spec.fn, requests, args.workers)
+    return {"operations": n, "latencies": latencies}
+
+
+def scenario_performance_spec_batch(n: int, args) -> Dict:
+    import battmo_prefect_flow as battmo
+
+    rng = random.Random(f"performance_spec_batch-{n}")
+    requests = [battmo.PerformanceSpecRequest(geometry=_random_geometry(rng)) for _ in range(n)]
+    chunk_size = max(1, -(-n // args.workers))
+    start = time.perf_counter()
+    battmo.run_performance_spec_batch.fn(requests, chunk_size=chunk_size, max_workers=args.workers)
+    return {"operations": n, "latencies": [time.perf_counter() - start]}
+
+
+def scenario_optimization(n: int, args) -> Dict:
+    import atinary_prefect_flow as atinary
+
+    batch_size = min(4, n)
+    request = atinary.BattmoOptimizationRequest(
+        backend="sdlabs", budget=max(1, n // batch_size), batch_size=batch_size, random_seed=n,
+        parallelism=args.workers, resume=False, poll_initial_s=0.01, poll_max_s=0.1, early_stop=args.early_stop,
+    )
+    start = time.perf_counter()
+    result = atinary.run_geometry_optimization.fn(request)
+    pruned = sum(1 for experiment in result.experiments if experiment.spec_response.status == "pruned")
+    return {"operations": len(result.experiments), "latencies": [time.perf_counter() - start], "pruned": pruned}
+
+
+def _osw_flow():
+    try:
+        import osw_prefect_flow
+    except ImportError as e:
+        return None, str(e)
+    return osw_prefect_flow, None
+
+
+def scenario_schedule_simulations(n: int, args) -> Dict:
+    osw_flow, error = _osw_flow()
+    if osw_flow is None:
+        return {"skipped": f"osw is not installed ({error})"}
+    osw = InMemoryOsw(osw_flow.model.BattmoModel, args.osw_latency)
+    titles = create_models(osw_flow, osw, n)
+    osw_flow.get_connection = lambda domain, user_name: FakeConnection(osw)
+    start = time.perf_counter()
+    osw_flow.schedule_simulation_requests.fn(osw_flow.SimulationRequest(model_titles=titles, max_concurrency=args.workers))
+    return {"operations": n, "latencies": [time.perf_counter() - start], "osw_loads": osw.loads, "osw_stores": osw.stores}
+
+
+def scenario_publish(n: int, args) -> Dict:
+    osw_flow, error = _osw_flow()
+    if osw_flow is None:
+        return {"skipped": f"osw is not installed ({error})"}
+    osw = InMemoryOsw(osw_flow.model.BattmoModel, args.osw_latency)
+    titles = create_models(osw_flow, osw, n)
+    osw_flow.get_connection = lambda domain, user_name: FakeConnection(osw)
+    archive = FakeArchive(args.archive_latency)
+    try:
+        start = time.perf_counter()
+        osw_flow.publish_models(
+            osw, titles, "sandbox.zenodo.org", url=archive.url, token="benchmark", max_concurrency=args.workers
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        archive.close()
+    return {"operations": n, "latencies": [elapsed], "archive_requests": archive.requests, "published": archive.published}
+
+
+def scenario_import(args, modules: List[str] = FLOW_MODULES) -> List[Dict]:
+    """Import time of every flow module in a fresh interpreter, prefect is imported first"""
+    code = (
+        "import json, sys, time\n"
+        "import prefect\n"
+        "start = time.perf_counter()\n"
+        "try:\n"
+        "    __import__(sys.argv[1])\n"
+        "    error = None\n"
+        "except ImportError as e:\n"
+        "    error = str(e)\n"
+        "elapsed = time.perf_counter() - start\n"
+        "print(json.dumps({'seconds': elapsed, 'error': error, 'heavy': [m for m in json.loads(sys.argv[2]) if m in sys.modules]}))\n"
+    )
+    results = []
+    for module in modules:
+        output = subprocess.run(
+            [sys.executable, "-c", code, module, json.dumps([m for m in HEAVY_MODULES if m not in ALLOWED_HEAVY_MODULES.get(module, [])])],
+            cwd=FLOWS_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        result = dict(json.loads(output), module=module)
+        if result["error"]:
+            result["skipped"] = result["error"]
+        result["over_budget"] = not result["error"] and result["seconds"] > args.import_budget_s
+        results.append(result)
+    return results
+
+
+SCENARIO_FUNCTIONS = {
+    "performance_spec": scenario_performance_spec,
+    "performance_spec_batch": scenario_performance_spec_batch,
+    "optimization": scenario_optimization,
+    "schedule_simulations": scenario_schedule_simulations,
+    "publish": scenario_publish,
+}
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def run(scenario: str, n: int, args) -> Dict:
+    rss_before = _rss_mb()
+    # the flows print progress for every request
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    start = time.perf_counter()
+    with output:
+        result = SCENARIO_FUNCTIONS[scenario](n, args)
+    elapsed = time.perf_counter() - start
+    result.update(scenario=scenario, n=n)
+    if "skipped" in result:
+        return result
+    latencies = np.array(result.pop("latencies"))
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    result.update(
+        seconds=elapsed,
+        throughput=result["operations"] / elapsed,
+        p50_s=float(p50),
+        p95_s=float(p95),
+        p99_s=float(p99),
+        rss_delta_mb=_rss_mb() - rss_before,
+        max_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    )
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the flows with local stand-ins for the external services")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake simulation time per geometry [s]")
+    parser.add_argument("--startup", type=float, default=0.5, help="fake octave startup time [s]")
+    parser.add_argument("--workers", type=int, default=4, help="octave workers and concurrent requests")
+    parser.add_argument("--optimizer-latency", type=float, default=0.02, help="fake SDLabs round-trip [s]")
+    parser.add_argument("--osw-latency", type=float, default=0.01, help="fake wiki round-trip [s]")
+    parser.add_argument("--archive-latency", type=float, default=0.01, help="fake archive round-trip [s]")
+    parser.add_argument("--early-stop", action="store_true", help="prune optimization runs below the incumbent")
+    parser.add_argument("--import-budget-s", type=float, default=0.5)
+    parser.add_argument("--json", help="write all results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the flows")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="battmo-benchmark-")
+    os.environ["BATTMO_HOME"] = workdir
+    for sub in ("input_json", "output_json"):
+        os.makedirs(os.path.join(workdir, "Examples", "experiment", "optimization_test", sub))
+    for name, sub in [("BATTMO_CACHE_DIR", "cache"), ("BATTMO_TRAJECTORY_DIR", "trajectories"),
+                      ("BATTMO_SWEEP_DIR", "sweeps"), ("OSW_CHANGE_FEED_DIR", "change_feed"),
+                      ("OSW_SCHEMA_CACHE_DIR", "schemas"), ("BATTMO_ZENODO_DEPOSITIONS", "zenodo_depositions.json")]:
+        os.environ[name] = os.path.join(workdir, sub)
+    os.environ["BATTMO_CHECKPOINT_DB"] = os.path.join(workdir, "optimizations.sqlite")
+    os.environ.pop("BATTMO_METRICS_FILE", None)
+    if not args.verbose:
+        os.environ.setdefault("PREFECT_LOGGING_LEVEL", "WARNING")
+    if FLOWS_DIR not in sys.path:
+        sys.path.insert(0, FLOWS_DIR)
+
+    results = []
+    failed = False
+    if "import" in args.scenarios:
+        for result in scenario_import(args):
+            results.append(dict(result, scenario="import"))
+            status = "skipped: " + result["skipped"] if result.get("skipped") else f"{result['seconds']:.3f} s"
+            if result["over_budget"] or result["heavy"]:
+                failed = True
+                status += f"  OVER BUDGET ({args.import_budget_s} s)" if result["over_budget"] else ""
+                status += f"  loads {result['heavy']}" if result["heavy"] else ""
+            print(f"import {result['module']:<24} {status}")
+
+    install_octave(args.latency, args.startup, args.workers)
+    install_sdlabs(args.optimizer_latency)
+    for scenario in args.scenarios:
+        if scenario == "import":
+            continue
+        for n in args.counts:
+            result = run(scenario, n, args)
+            results.append(result)
+            if "skipped" in result:
+                print(f"{scenario:<24} n={n:<6} skipped: {result['skipped']}")
+                break
+            print(
+                f"{scenario:<24} n={n:<6} {result['seconds']:8.3f} s  {result['throughput']:8.2f} ops/s  "
+                f"p50 {result['p50_s']:.3f} s  p95 {result['p95_s']:.3f} s  p99 {result['p99_s']:.3f} s  "
+                f"rss +{result['rss_delta_mb']:.1f} MB (max {result['max_rss_mb']:.0f} MB)"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
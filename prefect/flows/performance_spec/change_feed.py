@@ -0,0 +1,198 @@
+# Incremental polling of pending workflow runs.
+# Instead of running the full semantic search on every schedule tick, a local index of
+# BattmoModel pages and their pending (ToDo) workflow runs is kept up to date from the
+# wiki's recent changes since the last tick (watermark). Only changed pages are loaded.
+# Deleted pages and the old titles of moved pages are dropped from the index, as are pages
+# that can not be classified (e.g. deleted in the meantime).
+# Configuration via environment variables:
+#   OSW_CHANGE_FEED_DIR         directory of the index files (default: ~/.cache/battmo_prefect)
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+# overlap of consecutive ticks, protects against clock skew between agent and wiki
+WATERMARK_OVERLAP = timedelta(minutes=5)
+# recent changes are only kept for a limited time by MediaWiki, resync after this gap
+MAX_WATERMARK_AGE = timedelta(days=30)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    title TEXT PRIMARY KEY,
+    revid INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending (
+    title TEXT NOT NULL,
+    run_uuid TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    PRIMARY KEY (title, run_uuid, tool)
+);
+"""
+
+# (run uuid, tool) of every pending run of a page, None if the page is not a BattmoModel
+Classifier = Callable[[str], Optional[List[Tuple[str, str]]]]
+
+
+def _format(timestamp: datetime) -> str:
+    return timestamp.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse(timestamp) -> datetime:
+    if isinstance(timestamp, datetime):
+        return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+    if hasattr(timestamp, "tm_year"):  # time.struct_time, as returned by mwclient
+        return datetime(*timestamp[:6], tzinfo=timezone.utc)
+    return datetime.strptime(str(timestamp), "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+
+class PendingRunIndex:
+    """Watermark and per page state (revision id, pending runs) of one wiki"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+
+    @property
+    def watermark(self) -> Optional[datetime]:
+        row = self._db.execute("SELECT value FROM state WHERE key = 'watermark'").fetchone()
+        return _parse(row[0]) if row else None
+
+    def _set_watermark(self, timestamp: datetime):
+        self._db.execute("INSERT OR REPLACE INTO state VALUES ('watermark', ?)", (_format(timestamp),))
+
+    def _store_page(self, title: str, revid: int, runs: Optional[List[Tuple[str, str]]]):
+        self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?)", (title, revid))
+        self._db.execute("DELETE FROM pending WHERE title = ?", (title,))
+        self._db.executemany(
+            "INSERT OR IGNORE INTO pending VALUES (?, ?, ?)", [(title, str(run_uuid), tool) for run_uuid, tool in runs or []]
+        )
+
+    def _drop_page(self, title: str):
+        self._db.execute("DELETE FROM pages WHERE title = ?", (title,))
+        self._db.execute("DELETE FROM pending WHERE title = ?", (title,))
+
+    def _classify_page(self, title: str, revid: int, classify: Classifier) -> bool:
+        try:
+            runs = classify(title)
+        except Exception as e:
+            print(f"Change feed: dropping {title}, it could not be classified: {e}")
+            self._drop_page(title)
+            return False
+        self._store_page(title, revid, runs)
+        return True
+
+    def _revid(self, title: str) -> Optional[int]:
+        row = self._db.execute("SELECT revid FROM pages WHERE title = ?", (title,)).fetchone()
+        return row[0] if row else None
+
+    def resync(self, titles: List[str], classify: Classifier, now: datetime):
+        """Rebuild the index from a full query result"""
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM pending")
+            for title in titles:
+                self._classify_page(title, 0, classify)
+            self._set_watermark(now - WATERMARK_OVERLAP)
+            self._db.execute("COMMIT")
+
+    def apply_changes(self, changes: List[Dict], classify: Classifier, now: datetime) -> List[str]:
+        """Update the index from recent changes entries (title, revid, timestamp, see recent_changes)
+        fetched at now, returns the titles that were (re)classified or dropped"""
+        latest: Dict[str, Dict] = {}
+        for change in changes:
+            # oldest first, the last change of a page counts
+            latest[change["title"]] = change
+        updated = []
+        with self._lock:
+            for title, change in latest.items():
+                revid = self._revid(title)
+                if change.get("deleted"):
+                    if revid is not None:
+                        self._drop_page(title)
+                        updated.append(title)
+                    continue
+                if change.get("revid") and revid is not None and revid >= change["revid"]:
+                    continue  # seen in the overlap of the previous tick
+                if self._classify_page(title, change.get("revid") or 0, classify):
+                    updated.append(title)
+            watermark = self.watermark
+            if watermark is None or now - WATERMARK_OVERLAP > watermark:
+                self._set_watermark(now - WATERMARK_OVERLAP)
+        return updated
+
+    def pending_titles(self, tool: Optional[str] = None) -> List[str]:
+        """Titles of pages with pending runs (of the given tool)"""
+        with self._lock:
+            if tool:
+                rows = self._db.execute("SELECT DISTINCT title FROM pending WHERE tool = ? ORDER BY title", (tool,))
+            else:
+                rows = self._db.execute("SELECT DISTINCT title FROM pending ORDER BY title")
+            return [row[0] for row in rows.fetchall()]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def recent_changes(wtsite, since: datetime, title_prefix: str = "Item:") -> List[Dict]:
+    """Edits, page creations, deletions and moves since the given time, oldest first.
+    Deleted pages and the old title of moved pages have deleted=True, restored pages and the new
+    title of moved pages have revid None (always reclassified)."""
+    changes = []
+
+    def add(title: str, timestamp, revid: Optional[int] = None, deleted: bool = False):
+        if title and title.startswith(title_prefix):
+            changes.append({"title": title, "revid": revid, "timestamp": timestamp, "deleted": deleted})
+
+    for change in wtsite._site.recentchanges(
+        start=_format(since), dir="newer", prop="title|ids|timestamp|loginfo", type="edit|new|log"
+    ):
+        if change.get("type") != "log":
+            add(change["title"], change["timestamp"], change["revid"])
+        elif change.get("logtype") == "delete":
+            add(change["title"], change["timestamp"], deleted=change.get("logaction") == "delete")
+        elif change.get("logtype") == "move":
+            params = change.get("logparams") or {}
+            add(change["title"], change["timestamp"], deleted=True)
+            add(params.get("target_title") or params.get("new_title"), change["timestamp"])
+    return changes
+
+
+def poll(index: PendingRunIndex, wtsite, full_query: Callable[[], List[str]], classify: Classifier) -> List[str]:
+    """Bring the index up to date, with a full query only on the first tick or after a long gap.
+    Returns the titles that were (re)classified."""
+    now = datetime.now(timezone.utc)
+    watermark = index.watermark
+    if watermark is None or now - watermark > MAX_WATERMARK_AGE:
+        titles = full_query()
+        print(f"Change feed: full resync with {len(titles)} pages")
+        index.resync(titles, classify, now)
+        return titles
+    changes = recent_changes(wtsite, watermark)
+    updated = index.apply_changes(changes, classify, now)
+    print(f"Change feed: {len(changes)} changes since {_format(watermark)}, {len(updated)} pages updated")
+    return updated
+
+
+_indexes: Dict[str, PendingRunIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(domain: str) -> PendingRunIndex:
+    """Return the index of a wiki domain, created on first use"""
+    with _indexes_lock:
+        if domain not in _indexes:
+            directory = os.environ.get(
+                "OSW_CHANGE_FEED_DIR", os.path.join(os.path.expanduser("~"), ".cache", "battmo_prefect")
+            )
+            _indexes[domain] = PendingRunIndex(os.path.join(directory, f"pending_runs-{domain}.sqlite"))
+        return _indexes[domain]
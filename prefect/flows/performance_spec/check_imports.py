@@ -0,0 +1,34 @@
+# Import check of the flow modules, run by CI and by deploy_flow.sh before a deployment is built:
+#   python check_imports.py [--budget-s 0.5] [module ...]
+# Every module (default: all flow modules) is imported in a fresh interpreter after prefect.
+# Exits with 1 if a module takes longer than the budget, loads a heavy module it is not allowed
+# to load (see benchmark.HEAVY_MODULES) or can not be imported at all.
+
+import argparse
+import sys
+from typing import List, Optional
+
+import benchmark
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fail if importing a flow module is slow or loads heavy dependencies")
+    parser.add_argument("modules", nargs="*", default=benchmark.FLOW_MODULES)
+    parser.add_argument("--budget-s", type=float, default=0.5, help="max. import time of a module after prefect")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for result in benchmark.scenario_import(argparse.Namespace(import_budget_s=args.budget_s), args.modules):
+        if result["error"]:
+            status = f"FAILED to import: {result['error']}"
+        else:
+            status = f"{result['seconds']:.3f} s"
+            status += f"  OVER BUDGET ({args.budget_s} s)" if result["over_budget"] else ""
+            status += f"  loads {result['heavy']}" if result["heavy"] else ""
+        failed = failed or bool(result["error"] or result["over_budget"] or result["heavy"])
+        print(f"import {result['module']:<24} {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
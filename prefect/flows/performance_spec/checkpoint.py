@@ -0,0 +1,99 @@
+# Durable log of executed optimization experiments, keyed by the optimization request uuid.
+# A restarted optimization with the same uuid replays logged points instead of re-simulating them.
+# Backends that take observations (the local optimizer) get all logged points before the first ask,
+# SDLabs can not be told about points it did not suggest, only points it suggests again are replayed.
+# Configuration via environment variables:
+#   BATTMO_CHECKPOINT_DB        SQLite file (default: ~/.cache/battmo_prefect/optimizations.sqlite)
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    uuid TEXT PRIMARY KEY,
+    request TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS experiments (
+    run_uuid TEXT NOT NULL,
+    params_key TEXT NOT NULL,
+    param_values TEXT NOT NULL,
+    measurements TEXT NOT NULL,
+    experiment TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (run_uuid, params_key)
+);
+"""
+
+
+def default_path() -> str:
+    return os.environ.get(
+        "BATTMO_CHECKPOINT_DB",
+        os.path.join(os.path.expanduser("~"), ".cache", "battmo_prefect", "optimizations.sqlite"),
+    )
+
+
+def params_key(param_values: Dict[str, float]) -> str:
+    """Canonical key of a suggested point, robust against float formatting noise"""
+    return json.dumps({name: float(f"{value:.12g}") for name, value in param_values.items()}, sort_keys=True)
+
+
+class OptimizationCheckpoint:
+    """Append-only experiment log of one optimization run"""
+
+    def __init__(self, run_uuid: str, path: Optional[str] = None):
+        self.run_uuid = str(run_uuid)
+        self.path = path or default_path()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def load_request(self) -> Optional[str]:
+        """json of the request the run was started with, None for a new run"""
+        with self._lock:
+            row = self._db.execute("SELECT request FROM runs WHERE uuid = ?", (self.run_uuid,)).fetchone()
+        return row[0] if row else None
+
+    def save_request(self, request_json: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO runs (uuid, request, created) VALUES (?, ?, ?)",
+                (self.run_uuid, request_json, time.time()),
+            )
+
+    def completed(self) -> Dict[str, Dict]:
+        """Logged experiments by params_key: {"param_values": dict, "measurements": dict, "experiment": json str}, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT params_key, param_values, measurements, experiment FROM experiments WHERE run_uuid = ? ORDER BY created",
+                (self.run_uuid,),
+            ).fetchall()
+        return {
+            key: {"param_values": json.loads(param_values), "measurements": json.loads(measurements), "experiment": experiment}
+            for key, param_values, measurements, experiment in rows
+        }
+
+    def append(self, param_values: Dict[str, float], measurements: Dict[str, float], experiment_json: str):
+        """Durably log a completed experiment (committed before returning)"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO experiments VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.run_uuid,
+                    params_key(param_values),
+                    json.dumps(param_values),
+                    json.dumps(measurements),
+                    experiment_json,
+                    time.time(),
+                ),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
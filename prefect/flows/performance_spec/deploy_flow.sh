@@ -16,6 +16,10 @@ DEPLOY_COMMAND="/home/jovyan/.local/bin/prefect deployment apply $FUNCTION-deplo
 RUN_COMMAND="/home/jovyan/.local/bin/prefect agent start -p 'default-agent-pool'"
 
 # Run the commands
+echo "Running import check"
+# the flow module must import fast and without heavy dependencies, see check_imports.py
+python "$(dirname "$0")/check_imports.py" "$(basename "$PYTHON_FILE" .py)" || exit 1
+
 echo "Running build command"
 $BUILD_COMMAND
 
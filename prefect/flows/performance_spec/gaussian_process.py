@@ -0,0 +1,73 @@
+# Minimal NumPy Gaussian process regression with an RBF kernel.
+# Used by the local optimizer (expected improvement) and for surrogate screening.
+# Inputs should be scaled to the unit hypercube; outputs are standardized internally.
+
+import math
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+LENGTH_SCALES = (0.05, 0.1, 0.2, 0.3, 0.5, 0.8, 1.2)
+
+_erf = np.vectorize(math.erf, otypes=[float])
+
+
+def normal_cdf(z: np.ndarray) -> np.ndarray:
+    return 0.5 * (1.0 + _erf(np.asarray(z) / math.sqrt(2.0)))
+
+
+def normal_pdf(z: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * np.square(z)) / math.sqrt(2.0 * math.pi)
+
+
+def _rbf(a: np.ndarray, b: np.ndarray, length_scale: float) -> np.ndarray:
+    sq_dist = np.sum(a * a, axis=1)[:, None] + np.sum(b * b, axis=1)[None, :] - 2.0 * a @ b.T
+    return np.exp(-0.5 * np.maximum(sq_dist, 0.0) / length_scale**2)
+
+
+class GaussianProcess:
+    """GP with isotropic RBF kernel, the length scale is picked by maximum marginal likelihood"""
+
+    def __init__(self, noise: float = 1e-6, length_scales: Sequence[float] = LENGTH_SCALES):
+        self.noise = noise
+        self.length_scales = length_scales
+        self.length_scale: Optional[float] = None
+
+    def fit(self, x: np.ndarray, y: np.ndarray) -> "GaussianProcess":
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        y = np.asarray(y, dtype=float).ravel()
+        self._x = x
+        self._y_mean = y.mean()
+        self._y_std = y.std() or 1.0
+        z = (y - self._y_mean) / self._y_std
+        best = None
+        for length_scale in self.length_scales:
+            k = _rbf(x, x, length_scale) + self.noise * np.eye(len(x))
+            try:
+                chol = np.linalg.cholesky(k)
+            except np.linalg.LinAlgError:
+                continue
+            alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, z))
+            log_likelihood = -0.5 * z @ alpha - np.sum(np.log(np.diag(chol)))
+            if best is None or log_likelihood > best[0]:
+                best = (log_likelihood, length_scale, chol, alpha)
+        if best is None:
+            raise np.linalg.LinAlgError("Kernel matrix is not positive definite for any length scale")
+        _, self.length_scale, self._chol, self._alpha = best
+        return self
+
+    def predict(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Posterior mean and standard deviation at the rows of x"""
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        k_star = _rbf(x, self._x, self.length_scale)
+        mean = k_star @ self._alpha
+        v = np.linalg.solve(self._chol, k_star.T)
+        var = np.maximum(1.0 - np.sum(v * v, axis=0), 1e-12)
+        return mean * self._y_std + self._y_mean, np.sqrt(var) * self._y_std
+
+
+def expected_improvement(mean: np.ndarray, std: np.ndarray, incumbent: float, xi: float = 0.01) -> np.ndarray:
+    """Expected improvement over the incumbent for maximization"""
+    improvement = mean - incumbent - xi * abs(incumbent)
+    z = improvement / std
+    return improvement * normal_cdf(z) + std * normal_pdf(z)
@@ -0,0 +1,137 @@
+# Local, offline optimizer backend with the same ask/tell interface as the sdlabs_wrapper
+# optimization wrapper (config.budget, get_new_suggestions, send_measurements).
+# Supported algorithms: randomsearch, grid, sobol, latinhypercube (precomputed designs)
+# and a NumPy Gaussian process with expected improvement (gp). The SDLabs algorithm names
+# gpyopt, dragonfly and hyperopt are served by the gp implementation.
+
+from typing import Dict, List, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+import sampling
+from gaussian_process import GaussianProcess, expected_improvement
+
+ALGORITHM_ALIASES = {"gpyopt": "gp", "dragonfly": "gp", "hyperopt": "gp"}
+GP_CANDIDATES = 2048
+
+
+class LocalOptimizerConfig(BaseModel):
+    budget: int = 10
+    batch_size: int = 1
+    algorithm: str = "gp"
+    random_seed: int = 10
+    parameters: List[Dict]
+    objective: str = "energy_density"
+    goal: str = "max"
+
+
+class Suggestion(BaseModel):
+    param_values: Dict[str, float]
+    measurements: Optional[Dict[str, float]] = None
+
+
+class LocalOptimizer:
+    """Ask/tell optimizer over box bounded continuous parameters"""
+
+    def __init__(self, config: LocalOptimizerConfig):
+        self.config = config
+        self.algorithm = ALGORITHM_ALIASES.get(config.algorithm, config.algorithm)
+        if self.algorithm != "gp" and self.algorithm not in sampling.DESIGNS:
+            raise ValueError(f"Unknown algorithm '{config.algorithm}'")
+        self.names, self.low, self.high = sampling.bounds(config.parameters)
+        self.rng = np.random.default_rng(config.random_seed)
+        self.iteration = 0
+        self._x: List[np.ndarray] = []  # observed points (unit cube)
+        self._y: List[float] = []  # observed objective, sign flipped for minimization
+        self._pending: List[np.ndarray] = []  # suggested, not yet measured
+        n = config.budget * config.batch_size
+        if self.algorithm == "gp":
+            # initial design before the GP takes over
+            n = max(config.batch_size, len(self.names) + 1)
+            self._design = sampling.latin_hypercube(n, len(self.names), config.random_seed)
+        else:
+            self._design = sampling.design(self.algorithm, n, len(self.names), config.random_seed)
+        self._design_index = 0
+
+    def _sign(self) -> float:
+        return 1.0 if self.config.goal == "max" else -1.0
+
+    def _to_params(self, unit_point: np.ndarray) -> Dict[str, float]:
+        values = sampling.scale(unit_point, self.low, self.high)
+        return {name: float(value) for name, value in zip(self.names, values)}
+
+    def _from_params(self, param_values: Dict[str, float]) -> np.ndarray:
+        values = np.array([param_values[name] for name in self.names], dtype=float)
+        return sampling.unscale(values, self.low, self.high)
+
+    def observe(self, param_values: Dict[str, float], value: float):
+        """Add an observation that was not suggested by this optimizer (e.g. prior results)"""
+        self._x.append(self._from_params(param_values))
+        self._y.append(self._sign() * float(value))
+
+    def _observed(self, point: np.ndarray) -> bool:
+        return any(np.allclose(point, x) for x in self._x)
+
+    def _next_from_design(self, n: int) -> List[np.ndarray]:
+        points = []
+        while len(points) < n and self._design_index < len(self._design):
+            point = self._design[self._design_index]
+            self._design_index += 1
+            # design points observed already (e.g. logged before a restart) are not suggested again
+            if not self._observed(point):
+                points.append(point)
+        return points
+
+    def _next_from_gp(self, n: int) -> List[np.ndarray]:
+        x = np.array(self._x)
+        y = np.array(self._y)
+        candidates = self.rng.random((GP_CANDIDATES, len(self.names)))
+        # local candidates around the incumbent
+        best = x[np.argmax(y)]
+        local = np.clip(best + 0.05 * self.rng.standard_normal((GP_CANDIDATES // 4, len(self.names))), 0.0, 1.0)
+        candidates = np.vstack([candidates, local])
+        points = []
+        # kriging believer: pending points are added with their predicted mean
+        believed_x = list(x) + list(self._pending)
+        gp = GaussianProcess().fit(x, y)
+        believed_y = list(y) + list(gp.predict(np.array(self._pending))[0]) if self._pending else list(y)
+        for _ in range(n):
+            gp = GaussianProcess().fit(np.array(believed_x), np.array(believed_y))
+            mean, std = gp.predict(candidates)
+            ei = expected_improvement(mean, std, max(y))
+            i = int(np.argmax(ei))
+            points.append(candidates[i])
+            believed_x.append(candidates[i])
+            believed_y.append(float(mean[i]))
+            candidates = np.delete(candidates, i, axis=0)
+        return points
+
+    def get_new_suggestions(self, max_retries: int = 0, sleep_time_s: float = 0) -> List[Suggestion]:
+        """Return the next batch, an empty list once the budget is used up.
+        max_retries and sleep_time_s are accepted for compatibility with the SDLabs wrapper."""
+        if self.iteration >= self.config.budget:
+            return []
+        self.iteration += 1
+        n = self.config.batch_size
+        if self.algorithm == "gp" and len(self._y) > len(self.names):
+            # enough observations (e.g. prior results) for the GP, no initial design needed
+            points = []
+        else:
+            points = self._next_from_design(n)
+        if len(points) < n and self.algorithm == "gp":
+            if len(self._y) >= 2:
+                points += self._next_from_gp(n - len(points))
+            else:
+                points += list(self.rng.random((n - len(points), len(self.names))))
+        self._pending.extend(points)
+        return [Suggestion(param_values=self._to_params(point)) for point in points]
+
+    def send_measurements(self, suggestions: List[Suggestion]):
+        for suggestion in suggestions:
+            if not suggestion.measurements or self.config.objective not in suggestion.measurements:
+                continue
+            point = self._from_params(suggestion.param_values)
+            self._pending = [p for p in self._pending if not np.allclose(p, point)]
+            self._x.append(point)
+            self._y.append(self._sign() * float(suggestion.measurements[self.config.objective]))
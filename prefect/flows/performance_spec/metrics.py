@@ -0,0 +1,192 @@
+# Lightweight instrumentation of the flow stages (octave, optimizer, wiki, uploads).
+# Durations, counts, payload sizes and levels (e.g. queue depth) are aggregated per metric name
+# and label set in a process wide registry. FlowMetrics takes a snapshot at the start and at the
+# end of a flow, the difference is attached to the flow result as a JSON summary and the registry
+# is exported in the Prometheus text format (e.g. for the node exporter textfile collector).
+# Stages of concurrent flows in the same process show up in each other's summary.
+# Configuration via environment variables:
+#   BATTMO_METRICS_FILE         Prometheus text file, rewritten at the end of every flow (default: not written)
+
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+from typing import Dict, Optional, Tuple
+
+# (name, sorted label items)
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, object]) -> MetricKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(key: MetricKey, suffix: str = "") -> str:
+    name, labels = key
+    if not labels:
+        return name + suffix
+    label_text = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+    return f"{name}{suffix}{{{label_text}}}"
+
+
+class Registry:
+    """Counters, gauges and summaries (count, sum) keyed by name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[MetricKey, float] = {}
+        self._gauges: Dict[MetricKey, float] = {}
+        self._summaries: Dict[MetricKey, list] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.setdefault(key, [0, 0.0])
+            summary[0] += 1
+            summary[1] += value
+
+    def timer(self, name: str, **labels) -> "Timer":
+        return Timer(self, name, labels)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": {key: tuple(summary) for key, summary in self._summaries.items()},
+            }
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for key, value in sorted(snapshot["counters"].items()):
+            if key[0] not in typed:
+                lines.append(f"# TYPE {key[0]} counter")
+                typed.add(key[0])
+            lines.append(f"{_format(key)} {value}")
+        for key, value in sorted(snapshot["gauges"].items()):
+            if key[0] not in typed:
+                lines.append(f"# TYPE {key[0]} gauge")
+                typed.add(key[0])
+            lines.append(f"{_format(key)} {value}")
+        for key, (count, total) in sorted(snapshot["summaries"].items()):
+            if key[0] not in typed:
+                lines.append(f"# TYPE {key[0]} summary")
+                typed.add(key[0])
+            lines.append(f"{_format(key, '_count')} {count}")
+            lines.append(f"{_format(key, '_sum')} {total}")
+        return "\n".join(lines) + "\n"
+
+
+class Timer(ContextDecorator):
+    """Records the duration of a with-block or decorated function in seconds,
+    with an additional status="error" label if it raised"""
+
+    def __init__(self, registry: Registry, name: str, labels: Dict[str, object]):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self._local = threading.local()
+
+    def __enter__(self):
+        # a decorated function may run in several threads at once
+        self._local.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._local.start
+        labels = dict(self.labels, status="error") if exc_type else self.labels
+        self.registry.observe(self.name, duration, **labels)
+        return False
+
+
+def diff(before: Dict, after: Dict) -> Dict:
+    """JSON summary of what happened between two snapshots"""
+    summary = {}
+    for key, value in after["counters"].items():
+        delta = value - before["counters"].get(key, 0)
+        if delta:
+            summary[_format(key)] = delta
+    for key, value in after.get("gauges", {}).items():
+        # current value of the gauges that changed
+        if value != before.get("gauges", {}).get(key):
+            summary[_format(key)] = value
+    for key, (count, total) in after["summaries"].items():
+        previous = before["summaries"].get(key, (0, 0.0))
+        delta_count = count - previous[0]
+        if delta_count:
+            delta_sum = total - previous[1]
+            summary[_format(key)] = {"count": delta_count, "sum": delta_sum, "mean": delta_sum / delta_count}
+    return summary
+
+
+REGISTRY = Registry()
+
+
+def inc(name: str, value: float = 1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    REGISTRY.set(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def timer(name: str, **labels) -> Timer:
+    """Context manager and decorator: with timer("osw_store_seconds"): ..."""
+    return REGISTRY.timer(name, **labels)
+
+
+def snapshot() -> Dict:
+    return REGISTRY.snapshot()
+
+
+def export_prometheus(path: Optional[str] = None) -> Optional[str]:
+    """Write the registry to path (default: BATTMO_METRICS_FILE), returns the path written"""
+    path = path or os.environ.get("BATTMO_METRICS_FILE")
+    if not path:
+        return None
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(REGISTRY.prometheus())
+    os.replace(tmp_path, path)
+    return path
+
+
+class FlowMetrics:
+    """Measures a flow run, .summary holds the metrics recorded during the with-block"""
+
+    def __init__(self, flow_name: str):
+        self.flow_name = flow_name
+        self.summary: Dict = {}
+
+    def __enter__(self):
+        self._before = snapshot()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        status = "error" if exc_type else "ok"
+        observe("battmo_flow_seconds", time.perf_counter() - self._start, flow=self.flow_name, status=status)
+        self.summary = diff(self._before, snapshot())
+        try:
+            export_prometheus()
+        except OSError as e:
+            print(f"Failed to export metrics: {e}")
+        return False
@@ -0,0 +1,103 @@
+function [E, energyDensity, energy, status, upperBound] = runJsonFunctionBatch(baseFile, geometryJsons, pruneBelow)
+% Run BattMo for several geometries in one call.
+% The base parameter set is parsed only once and merged with every geometry.
+%
+% baseFile      - base parameter json file, relative to the BattMo root
+% geometryJsons - cell array of json strings, one Geometry1D per simulation
+% pruneBelow    - optional, one energy density threshold per geometry (NaN: no pruning).
+%                 A run is aborted as soon as an upper bound of its final energy density
+%                 falls below its threshold (-Inf: never). These runs compute their series
+%                 from the simulated steps (see series), not with runBatteryJson's output,
+%                 their values are only comparable with those of other prunable runs.
+%
+% Returns cell arrays (one entry per geometry) with the E, energyDensity and
+% energy time series, and the status ('ok', 'pruned' or the error message) of each run.
+% upperBound holds the energy density bound at the last step of pruned runs (empty otherwise).
+% A failing geometry does not abort the remaining ones.
+
+    base = parseBattmoJson(baseFile);
+
+    n = numel(geometryJsons);
+    if nargin < 3
+        pruneBelow = nan(1, n);
+    end
+    E = cell(1, n);
+    energyDensity = cell(1, n);
+    energy = cell(1, n);
+    status = cell(1, n);
+    upperBound = cell(1, n);
+
+    for i = 1:n
+        try
+            geometry = jsondecode(geometryJsons{i});
+            % the geometry takes precedence over the base parameter set
+            jsonstruct = mergeJsonStructs({geometry, base});
+            jsonstruct.Output.variables = {'energy'};
+            if isnan(pruneBelow(i))
+                output = runBatteryJson(jsonstruct);
+                E{i} = output.E;
+                energyDensity{i} = output.energyDensity;
+                energy{i} = output.energy;
+                status{i} = 'ok';
+            else
+                [E{i}, energyDensity{i}, energy{i}, bound] = runPruned(jsonstruct, pruneBelow(i));
+                if bound < pruneBelow(i)
+                    upperBound{i} = bound;
+                    status{i} = 'pruned';
+                else
+                    status{i} = 'ok';
+                end
+            end
+        catch err
+            E{i} = [];
+            energyDensity{i} = [];
+            energy{i} = [];
+            status{i} = ['error: ', err.message];
+        end
+    end
+end
+
+function [E, energyDensity, energy, bound] = runPruned(jsonstruct, threshold)
+% Simulate with a bound check after every step, returns the series up to the last step
+% and the energy density bound at that step.
+
+    setup = runBatteryJson(jsonstruct, 'runSimulation', false);
+    model = setup.model;
+    volume = sum(model.G.cells.volumes);
+    capacity = computeCellCapacity(model);
+
+    afterStep = @(model, states, reports, solver, schedule, simtime) ...
+        checkBound(model, states, reports, solver, volume, capacity, threshold);
+    [~, states] = simulateScheduleAD(setup.initstate, model, setup.schedule, ...
+                                     'OutputMinisteps', true, ...
+                                     'NonLinearSolver', setup.nonLinearSolver, ...
+                                     'afterStepFn', afterStep);
+
+    [E, energyDensity, energy, boundSeries] = series(states, volume, capacity);
+    bound = boundSeries(end);
+end
+
+function [model, states, reports, solver, ok] = checkBound(model, states, reports, solver, volume, capacity, threshold)
+% afterStepFn of simulateScheduleAD, returning ok = false stops the simulation
+    [~, ~, ~, bound] = series(states, volume, capacity);
+    ok = isempty(bound) || bound(end) >= threshold;
+end
+
+function [E, energyDensity, energy, bound] = series(states, volume, capacity)
+% Time series of the steps simulated so far. The final energy is at most the energy so far
+% plus the remaining capacity discharged at the highest voltage seen so far.
+
+    states = states(~cellfun(@isempty, states));
+    time = cellfun(@(state) state.time, states);
+    E = cellfun(@(state) state.Control.E, states);
+    I = cellfun(@(state) state.Control.I, states);
+    if numel(time) < 2
+        energy = zeros(size(time));
+        charge = zeros(size(time));
+    else
+        energy = cumtrapz(time, E .* I);
+        charge = cumtrapz(time, I);
+    end
+    energyDensity = energy / volume;
+    bound = (energy + max(capacity - charge, 0) .* cummax(E)) / volume;
+end
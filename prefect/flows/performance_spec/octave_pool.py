@@ -0,0 +1,217 @@
+# Pool of warm Octave sessions for BattMo simulations.
+# Every worker runs startupBattMo.m once and is then leased to simulation requests.
+# Configuration via environment variables:
+#   BATTMO_HOME                 BattMo checkout (default: /home/jovyan/BattMo)
+#   BATTMO_OCTAVE_WORKERS       max. number of concurrent Octave sessions (default: number of cores)
+#   BATTMO_OCTAVE_MAX_JOBS      recycle a worker after this many jobs (default: 50, 0 = never)
+#   BATTMO_OCTAVE_MAX_RSS_MB    recycle a worker above this resident memory (default: 4096, 0 = never)
+
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+import metrics
+from admission import get_controller
+
+BATTMO_HOME = os.environ.get("BATTMO_HOME", "/home/jovyan/BattMo")
+BATTMO_STARTUP_SCRIPT = os.path.join(BATTMO_HOME, "startupBattMo.m")
+# Octave functions shipped with the flows (e.g. runJsonFunctionBatch.m)
+OCTAVE_FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "octave")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _rss_mb(pid: Optional[int]) -> Optional[float]:
+    """Resident memory of a process in MB, read from /proc (Linux only)"""
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class OctaveWorker:
+    """A single long-lived Octave session with BattMo on its path"""
+
+    def __init__(self, startup_script: str = BATTMO_STARTUP_SCRIPT):
+        from oct2py import Oct2Py
+
+        with metrics.timer("battmo_octave_startup_seconds"):
+            self.session = Oct2Py()
+            self.session.run(startup_script)
+        self.session.addpath(OCTAVE_FUNCTIONS_DIR)
+        self.jobs = 0
+        self.started_at = time.time()
+
+    @property
+    def pid(self) -> Optional[int]:
+        # oct2py does not expose the process id publicly, the engine holds a pexpect child
+        engine = getattr(self.session, "_engine", None)
+        child = getattr(getattr(engine, "repl", None), "child", None)
+        return getattr(child, "pid", None)
+
+    def alive(self) -> bool:
+        engine = getattr(self.session, "_engine", None)
+        child = getattr(getattr(engine, "repl", None), "child", None)
+        if child is None:
+            return engine is not None
+        return child.isalive()
+
+    def rss_mb(self) -> Optional[float]:
+        return _rss_mb(self.pid)
+
+    def close(self):
+        try:
+            self.session.exit()
+        except Exception as e:
+            print(f"Failed to close octave worker: {e}")
+
+
+class OctaveWorkerPool:
+    """Leases warm Octave workers, recycles them after max_jobs or above max_rss_mb and replaces crashed ones.
+
+    Workers are started lazily, so an idle agent does not hold any Octave processes.
+    """
+
+    def __init__(
+        self,
+        size: Optional[int] = None,
+        max_jobs: int = 50,
+        max_rss_mb: float = 4096,
+        startup_script: str = BATTMO_STARTUP_SCRIPT,
+    ):
+        self.size = size or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.startup_script = startup_script
+        self._idle: List[OctaveWorker] = []
+        self._started = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _new_worker(self) -> OctaveWorker:
+        return OctaveWorker(self.startup_script)
+
+    def _acquire(self, timeout: Optional[float] = None) -> OctaveWorker:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        dead: List[OctaveWorker] = []
+        try:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Octave worker pool is closed")
+                    while self._idle:
+                        # LIFO: reuse the most recently used (hottest) worker
+                        worker = self._idle.pop()
+                        if worker.alive():
+                            return worker
+                        # died while idle (e.g. killed for memory), replaced instead of failing a job
+                        self._started -= 1
+                        dead.append(worker)
+                    if self._started < self.size:
+                        self._started += 1
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No octave worker available after {timeout} s")
+                    self._condition.wait(remaining)
+        finally:
+            for worker in dead:
+                print(f"Idle octave worker {worker.pid} died, replacing it")
+                metrics.inc("battmo_octave_worker_crashes_total")
+                worker.close()
+        # start the new worker outside the lock, this takes several seconds
+        try:
+            return self._new_worker()
+        except BaseException:
+            self._discard(None)
+            raise
+
+    def _should_recycle(self, worker: OctaveWorker, rss: Optional[float]) -> bool:
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            return True
+        if self.max_rss_mb and rss is not None and rss > self.max_rss_mb:
+            return True
+        return False
+
+    def _release(self, worker: OctaveWorker):
+        with self._condition:
+            if not self._closed:
+                self._idle.append(worker)
+                self._condition.notify()
+                return
+        worker.close()
+
+    def _discard(self, worker: Optional[OctaveWorker]):
+        if worker is not None:
+            worker.close()
+        with self._condition:
+            self._started -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        """Lease a warm Octave session for the duration of the with-block"""
+        start = time.perf_counter()
+        worker = self._acquire(timeout)
+        metrics.observe("battmo_octave_lease_wait_seconds", time.perf_counter() - start)
+        healthy = True
+        try:
+            yield worker.session
+        except Exception:
+            # errors raised by BattMo leave the session usable, a dead process does not
+            healthy = worker.alive()
+            if not healthy:
+                print(f"Octave worker {worker.pid} crashed, replacing it")
+                metrics.inc("battmo_octave_worker_crashes_total")
+            raise
+        finally:
+            worker.jobs += 1
+            rss = worker.rss_mb() if healthy else None
+            if rss is not None:
+                # memory estimate of a simulation for the admission control
+                get_controller().record_rss(rss)
+            if healthy and not self._should_recycle(worker, rss):
+                self._release(worker)
+            else:
+                if healthy:
+                    metrics.inc("battmo_octave_worker_recycles_total")
+                self._discard(worker)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+            self._condition.notify_all()
+        for worker in idle:
+            worker.close()
+
+
+_pool: Optional[OctaveWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> OctaveWorkerPool:
+    """Return the process wide worker pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OctaveWorkerPool(
+                size=_env_int("BATTMO_OCTAVE_WORKERS", os.cpu_count() or 1),
+                max_jobs=_env_int("BATTMO_OCTAVE_MAX_JOBS", 50),
+                max_rss_mb=_env_int("BATTMO_OCTAVE_MAX_RSS_MB", 4096),
+            )
+            atexit.register(_pool.close)
+        return _pool
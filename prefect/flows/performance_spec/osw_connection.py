@@ -0,0 +1,132 @@
+# Thread safe cache of authenticated OSW connections, keyed by domain and user.
+# Connections (and with them the HTTP keep-alive pool of the mwclient session) are reused
+# across flow runs of the same agent. Credentials are loaded from Prefect Secret blocks and
+# only reloaded after credential_ttl_s or when the wiki rejects the session.
+
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from osw.core import OSW
+from osw.wtsite import WtSite
+
+# MediaWiki API error codes that indicate an expired or invalid login
+AUTH_ERROR_CODES = {
+    "assertuserfailed",
+    "assertbotfailed",
+    "badtoken",
+    "notloggedin",
+    "readapidenied",
+    "writeapidenied",
+    "permissiondenied",
+    "mwoauth-invalid-authorization",
+}
+
+
+def is_auth_error(error: Exception) -> bool:
+    if type(error).__name__ in ("LoginError", "InsufficientPermission"):
+        return True
+    code = getattr(error, "code", None)
+    if code is None and getattr(error, "args", None):
+        code = error.args[0]
+    return isinstance(code, str) and code in AUTH_ERROR_CODES
+
+
+def secret_password(user_name: str, domain: str) -> str:
+    """Password from the Prefect Secret block named <user>-<domain with dashes>"""
+    from prefect.blocks.system import Secret
+
+    return Secret.load(user_name.lower() + "-" + domain.replace(".", "-")).get()
+
+
+class OswConnection:
+    """Logged in WtSite and OSW of one user on one domain, re-login on auth errors"""
+
+    def __init__(
+        self,
+        domain: str,
+        user_name: str,
+        password_provider: Callable[[str, str], str] = secret_password,
+        credential_ttl_s: float = 3600,
+    ):
+        self.domain = domain
+        self.user_name = user_name
+        self.password_provider = password_provider
+        self.credential_ttl_s = credential_ttl_s
+        self._password: Optional[str] = None
+        self._password_loaded = 0.0
+        self._lock = threading.RLock()
+        self._login()
+
+    def _credentials(self, refresh: bool = False) -> str:
+        expired = time.time() - self._password_loaded > self.credential_ttl_s
+        if self._password is None or refresh or expired:
+            self._password = self.password_provider(self.user_name, self.domain)
+            self._password_loaded = time.time()
+        return self._password
+
+    def _login(self, refresh_credentials: bool = False):
+        with self._lock:
+            password = self._credentials(refresh_credentials)
+            self._wtsite = WtSite.from_domain(self.domain, None, {"username": self.user_name, "password": password})
+            self._osw = OSW(site=self._wtsite)
+            self.logged_in_at = time.time()
+
+    def relogin(self):
+        print(f"Re-login to {self.domain} as {self.user_name}")
+        self._login(refresh_credentials=True)
+
+    def call(self, target: str, name: str, *args, **kwargs):
+        """Call a method of the wtsite or osw object, retried once after a re-login on auth errors"""
+        generation = self.logged_in_at
+        try:
+            return getattr(getattr(self, "_" + target), name)(*args, **kwargs)
+        except Exception as e:
+            if not is_auth_error(e):
+                raise
+            with self._lock:
+                # another thread may have logged in again in the meantime
+                if self.logged_in_at == generation:
+                    self.relogin()
+            return getattr(getattr(self, "_" + target), name)(*args, **kwargs)
+
+    @property
+    def wtsite(self) -> WtSite:
+        return _ReloginProxy(self, "wtsite")
+
+    @property
+    def osw(self) -> OSW:
+        return _ReloginProxy(self, "osw")
+
+
+class _ReloginProxy:
+    """Forwards attribute access to the current wtsite/osw of a connection, method calls via OswConnection.call"""
+
+    def __init__(self, connection: OswConnection, target: str):
+        self._connection = connection
+        self._target = target
+
+    def __getattr__(self, name):
+        value = getattr(getattr(self._connection, "_" + self._target), name)
+        if not callable(value) or isinstance(value, type):
+            return value
+
+        def method(*args, **kwargs):
+            return self._connection.call(self._target, name, *args, **kwargs)
+
+        return method
+
+
+_connections: Dict[Tuple[str, str], OswConnection] = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(domain: str, user_name: str, **kwargs) -> OswConnection:
+    """Return the cached connection for (domain, user), logging in on first use"""
+    key = (domain, user_name)
+    with _connections_lock:
+        connection = _connections.get(key)
+        if connection is None:
+            connection = OswConnection(domain, user_name, **kwargs)
+            _connections[key] = connection
+        return connection
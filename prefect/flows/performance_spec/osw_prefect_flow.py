@@ -1,69 +1,102 @@
 import os
-from importlib import reload
 
 import osw.model.entity as model
 from osw.core import OSW
 from osw.wtsite import WtSite
+from osw_connection import OswConnection, get_connection
+from schema_cache import get_schema_cache
+from write_back import WriteBack
+from metrics import FlowMetrics
+import metrics
 
-from battmo_prefect_flow import run_performance_spec, PerformanceSpecRequest, PerformanceSpecResponse
-from atinary_prefect_flow import run_geometry_optimization, ExecutedExperiment, BattmoOptimizationRequest, BattmoOptimizationResult
+from battmo_prefect_flow import simulate_performance_spec, PerformanceSpecRequest, PerformanceSpecResponse
+from atinary_prefect_flow import run_geometry_optimization, ExecutedExperiment, BattmoOptimizationRequest, BattmoOptimizationResult, PriorObservation
 from prefect import flow, task
 from prefect.blocks.system import Secret
 import random
+import change_feed
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from pydantic import BaseModel
 from typing import List, Optional
 import uuid
 
-from zenodo_client import Creator, Metadata, ensure_zenodo
-
-import json
 import os
-import logging
-import requests
-from big_map_archive_api.create_and_share_records import prepare_output_file, upload_record, publish_record, save_to_file
 
 
 #os.environ["PATH"] = "/home/jovyan/.local/bin" #PATH=$PATH:~/.local/bin/
 os.environ["PATH"] += os.pathsep + "/home/jovyan/.local/bin" # ensure datamodel-codegen is found
 #os.environ["PREFECT_API_URL"] = "http://127.0.0.1:4200/api"
 
+BATTMO_MODEL_CATEGORY = "Category:OSW553f78cc66194ae1873241207b906c4b"
+TODO_STATUS = "Item:OSWaa8d29404288446a9f3ec7afa4e2a512"
+DONE_STATUS = "Item:OSWf474ec34b7df451ea8356134241aef8a"
+BATTMO_SIMULATION_TOOL = "Item:OSWe7c08b2300f04d0bbb0a55bca8838437"
+BATTMO_OPTIMIZATION_TOOL = "Item:OSWb80747f1ccf340d790955572d27f678c"
+
 
 class ConnectionSettings(model.OswBaseModel):
     osw_user_name: Optional[str] = "OnterfaceBot"
     osw_domain: Optional[str] = "onterface.open-semantic-lab.org"
 
 @task
-def connect(settings: ConnectionSettings):
-    global wtsite
-    # fetch secret from calculated name
-    password = Secret.load(settings.osw_user_name.lower() + '-' + settings.osw_domain.replace('.','-'))
-    wtsite = WtSite.from_domain(settings.osw_domain, None, {"username": settings.osw_user_name, "password": password.get()})
-    global osw
-    osw = OSW(site=wtsite)
+def connect(settings: ConnectionSettings) -> OswConnection:
+    # reuses the logged in session of previous flow runs in this agent,
+    # the password is fetched from the secret with the calculated name <user>-<domain>
+    return get_connection(settings.osw_domain, settings.osw_user_name)
 
 @task
-def fetch_schema():
+def fetch_schema(connection: OswConnection):
     # osw.fetch_schema() #this will load the current entity schema from the OSW instance.
     # You may have to re-run the script to get the updated schema extension.
     # Requires 'pip install datamodel-code-generator'
+    # The generated model is cached, codegen only runs if one of the schemas changed (see schema_cache)
     list_of_categories = [
         #"Category:OSWb79812225c7849b78e98f2b3b10498b3", # WorkflowRun
         #"Category:OSW553f78cc66194ae1873241207b906c4b", # BattMoModel
     ]
-    for i, cat in enumerate(list_of_categories):
-        mode = "append"
-        if i == 0:
-            mode = "replace"
-        osw.fetch_schema(OSW.FetchSchemaParam(schema_title=cat, mode=mode))
-    #reload(model)
+    def generate(categories):
+        for i, cat in enumerate(categories):
+            mode = "append"
+            if i == 0:
+                mode = "replace"
+            connection.osw.fetch_schema(OSW.FetchSchemaParam(schema_title=cat, mode=mode))
+    with metrics.timer("osw_fetch_schema_seconds"):
+        get_schema_cache().ensure(list_of_categories, connection.wtsite, generate, model)
 
-@task
-def query_pending_requests():
+def classify_model(osw: OSW, title: str):
+    """(run uuid, tool) of all pending runs of a BattmoModel page, None for other pages"""
+    with metrics.timer("osw_load_seconds"):
+        entity = osw.load_entity(title)
+    if BATTMO_MODEL_CATEGORY not in (getattr(entity, "type", None) or []):
+        return None
+    model_entity = entity.cast(model.BattmoModel)
+    pending = []
+    for run in model_entity.workflow_runs or []:
+        if run.status != TODO_STATUS or not run.tool:
+            continue
+        for tool in (run.tool if isinstance(run.tool, list) else [run.tool]):
+            pending.append((run.uuid, tool))
+    return pending
+
+def query_all_pending_requests(wtsite: WtSite):
     print("Query")
-    models = wtsite.semantic_search("[[Category:OSW553f78cc66194ae1873241207b906c4b]][[HasWorkflowRuns.HasStatus::Item:OSWaa8d29404288446a9f3ec7afa4e2a512]]")
+    models = wtsite.semantic_search(f"[[{BATTMO_MODEL_CATEGORY}]][[HasWorkflowRuns.HasStatus::{TODO_STATUS}]]")
     return models
 
+@task
+def query_pending_requests(connection: OswConnection, tool: str):
+    """Titles of models with pending runs of the tool, from the incrementally updated local index"""
+    index = change_feed.get_index(connection.domain)
+    with metrics.timer("osw_query_pending_seconds"):
+        change_feed.poll(
+            index,
+            connection.wtsite,
+            lambda: query_all_pending_requests(connection.wtsite),
+            lambda title: classify_model(connection.osw, title)
+        )
+    return index.pending_titles(tool)
+
 class Result(model.OswBaseModel):
     battmo_result: PerformanceSpecResponse
     battmo_model: model.BattmoModel
@@ -72,11 +105,9 @@ class OptimizationResult(model.OswBaseModel):
     atinary_result: BattmoOptimizationResult
     battmo_model: model.BattmoModel
 
-@task
-def store_and_document_result(result: Result):
-    print(result)
-    title = "Item:" + osw.get_osw_id(result.battmo_model.uuid)
-    model_entity = osw.load_entity(title).cast(model.BattmoModel)
+def document_result(write_back: WriteBack, result: Result):
+    """Apply a simulation result to the tracked model entity, stored on the next flush"""
+    model_entity = write_back.track(result.battmo_model)
     model_entity.performance = { "uuid": uuid.uuid4(), "energyDensity": result.battmo_result.result.energyDensity}
     #if (not model_entity.statements): model_entity.statements = []
     #model_entity.statements.append(model.Statement(
@@ -86,140 +117,203 @@ def store_and_document_result(result: Result):
     #  unit_symbol = "J/m³",
     #  value = str(result.battmo_result.result.energyDensity) + " J/m³"
     #));
-    for run in model_entity.workflow_runs:
-        if (run.uuid == result.battmo_result.uuid):
-            run.status = "Item:OSWf474ec34b7df451ea8356134241aef8a"
-            print(run.uuid)
-            break
-    osw.store_entity(model_entity)
+    run = write_back.run(model_entity, result.battmo_result.uuid)
+    if run:
+        run.status = DONE_STATUS
+        print(run.uuid)
+
+def document_optimization_result(write_back: WriteBack, result: OptimizationResult):
+    """Apply the best run of an optimization to the tracked model entity, stored on the next flush"""
+    model_entity = write_back.track(result.battmo_model)
+    model_entity.geometry = result.atinary_result.best_run.geometry
+    model_entity.performance = { "uuid": uuid.uuid4(), "energyDensity": result.atinary_result.best_run.spec_response.result.energyDensity}
+    # the optimization runs under the uuid of the workflow run, its simulations have their own
+    run = write_back.run(model_entity, result.atinary_result.uuid)
+    if run:
+        run.status = DONE_STATUS
+        print(run.uuid)
+
+@task
+def store_and_document_result(osw: OSW, result: Result):
+    # the entity loaded by the scheduler is updated, no reload before the store
+    print(result)
+    with WriteBack(osw) as write_back:
+        document_result(write_back, result)
+        write_back.flush()
     print("FINISHED")
     
 @task
-def store_and_document_optimization_result(result: OptimizationResult):
+def store_and_document_optimization_result(osw: OSW, result: OptimizationResult):
     file_name = 'optimization.json'
     with open(file_name, "w", encoding="utf-8") as f:
         f.write(result.json(exclude_none=True))
-    title = "Item:" + osw.get_osw_id(result.battmo_model.uuid)
-    model_entity = osw.load_entity(title).cast(model.BattmoModel)
-    model_entity.geometry = result.atinary_result.best_run.geometry
-    model_entity.performance = { "uuid": uuid.uuid4(), "energyDensity": result.atinary_result.best_run.spec_response.result.energyDensity}
-    #if (not model_entity.statements): model_entity.statements = []
-    #model_entity.statements.append(model.Statement(
-    #  quantity = "Property:EnergyDensity",
-    #  numerical_value = str(result.battmo_result.result.energyDensity),
-    #  unit = "Property:EnergyDensity#OSW5b8270a6329d4831b414a5ef5d4ca946",
-    #  unit_symbol = "J/m³",
-    #  value = str(result.battmo_result.result.energyDensity) + " J/m³"
-    #));
-    for run in model_entity.workflow_runs:
-        if (run.uuid == result.atinary_result.best_run.spec_response.uuid):
-            run.status = "Item:OSWf474ec34b7df451ea8356134241aef8a"
-            print(run.uuid)
-            break
-    osw.store_entity(model_entity)
+    with WriteBack(osw) as write_back:
+        document_optimization_result(write_back, result)
+        write_back.flush()
     print("FINISHED")
     
 class SimulationRequest(model.OswBaseModel):
     model_titles: List[str]
     osw_instance: Optional[str] = "onterface.open-semantic-lab.org"
+    max_concurrency: Optional[int] = 4 # simulations running at the same time
+    load_concurrency: Optional[int] = 8 # entities loaded at the same time
+    store_concurrency: Optional[int] = 4 # entities stored at the same time
+
+def load_models(osw: OSW, titles: List[str], max_workers: int = 8, errors: Optional[dict] = None) -> List[model.BattmoModel]:
+    """Load and cast the BattmoModel entities concurrently, in the order of titles.
+    Pages that fail to load are skipped (and added to errors by title), they do not block the others"""
+    def load(title):
+        try:
+            with metrics.timer("osw_load_seconds"):
+                return osw.load_entity(title).cast(model.BattmoModel)
+        except Exception as e:
+            print(f"Loading {title} failed, skipping it: {e}")
+            metrics.inc("osw_load_failed_total")
+            if errors is not None:
+                errors[title] = e
+            return None
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(titles)))) as executor:
+        return [m for m in executor.map(load, titles) if m is not None]
+
+def pending_runs(model_entity: model.BattmoModel, tool: str) -> list:
+    """Workflow runs of the model with status ToDo for the given tool"""
+    return [
+        run for run in (model_entity.workflow_runs or [])
+        if run.status == TODO_STATUS and run.tool and tool in run.tool
+    ]
     
+def schedule_simulations(request: SimulationRequest):
+    connection = connect(ConnectionSettings(osw_domain=request.osw_instance))
+    osw = connection.osw
+    fetch_schema(connection)
+    if not request.model_titles:
+        request.model_titles = query_pending_requests(connection, BATTMO_SIMULATION_TOOL)
+    if not request.model_titles:
+        return
+    models = load_models(osw, request.model_titles, request.load_concurrency)
+    jobs = [(m, run) for m in models for run in pending_runs(m, BATTMO_SIMULATION_TOOL)]
+    print(f"{len(jobs)} pending simulations in {len(models)} models")
+    # simulate all pending runs in parallel, results are applied to the loaded entities
+    # and every model is stored once, as soon as all of its runs have finished
+    remaining = {}
+    for m, run in jobs:
+        remaining[str(m.uuid)] = remaining.get(str(m.uuid), 0) + 1
+    with WriteBack(osw, request.store_concurrency) as write_back, \
+            ThreadPoolExecutor(max_workers=max(1, request.max_concurrency)) as executor:
+        for m in models:
+            write_back.track(m)
+        futures = {}
+        for m, run in jobs:
+            print(run.uuid, m.geometry)
+            futures[executor.submit(simulate_performance_spec, PerformanceSpecRequest(geometry=m.geometry, uuid=run.uuid, priority="interactive"))] = m
+        for future in as_completed(futures):
+            m = futures[future]
+            try:
+                document_result(write_back, Result(
+                    battmo_result = future.result(),
+                    battmo_model = m
+                ))
+            except Exception as e:
+                print(f"Simulation for {m.uuid} failed: {e}")
+            remaining[str(m.uuid)] -= 1
+            if remaining[str(m.uuid)] == 0:
+                write_back.flush([m])
+
 @flow(validate_parameters=True) # validation will fail due to model.entity class
 def schedule_simulation_requests(request: SimulationRequest):
-    connect(ConnectionSettings(domain=request.osw_instance))
-    fetch_schema()
-    if not request.model_titles:
-        request.model_titles = query_pending_requests()
-    m = None
-    uuid = None
-    for title in request.model_titles:
-        model_entity = osw.load_entity(title)
-        #model_entity.uuid
-        model_entity = model_entity.cast(model.BattmoModel)
-        for run in model_entity.workflow_runs:
-            if (run.status == "Item:OSWaa8d29404288446a9f3ec7afa4e2a512" # ToDo
-                and run.tool
-                and "Item:OSWe7c08b2300f04d0bbb0a55bca8838437" in run.tool # BattmoSimulation
-               ):
-                m = model_entity
-                uuid = run.uuid
-                print(run.uuid)
-                break
-    if (m):
-        print(m.geometry)
-        result = run_performance_spec(PerformanceSpecRequest(
-            geometry = m.geometry,
-            uuid = uuid
-        ))
-        store_and_document_result(Result(
-            battmo_result = result,
-            battmo_model = m
-        ))
-        #store_and_document_results.submit(wait_for=flowA)
+    # returns the stage timings and counts of the run, see metrics.FlowMetrics
+    with FlowMetrics("schedule_simulation_requests") as flow_metrics:
+        schedule_simulations(request)
+    return flow_metrics.summary
         
 class OptimizationRequest(model.OswBaseModel):
     model_titles: List[str]
     osw_instance: Optional[str] = "onterface.open-semantic-lab.org"
+    warm_start: Optional[bool] = False # seed the local optimizer (instead of SDLabs) with the model's performance and local prior results
+
+def prior_observation(model_entity: model.BattmoModel) -> Optional[PriorObservation]:
+    """Current geometry and energy density of a model, None if it has no performance yet"""
+    performance = model_entity.performance
+    if isinstance(performance, dict):
+        energy_density = performance.get("energyDensity")
+    else:
+        energy_density = getattr(performance, "energyDensity", None)
+    if model_entity.geometry is None or energy_density is None:
+        return None
+    return PriorObservation(geometry=model_entity.geometry, energy_density=energy_density)
     
-@flow(validate_parameters=True) # validation will fail due to model.entity class
-def schedule_optimization_requests(request: OptimizationRequest):
-    connect(ConnectionSettings(domain=request.osw_instance))
-    fetch_schema()
+def schedule_optimizations(request: OptimizationRequest):
+    connection = connect(ConnectionSettings(osw_domain=request.osw_instance))
+    osw = connection.osw
+    fetch_schema(connection)
     if not request.model_titles:
-        request.model_titles = query_pending_requests()
+        request.model_titles = query_pending_requests(connection, BATTMO_OPTIMIZATION_TOOL)
     m = None
     uuid = None
     for title in request.model_titles:
-        model_entity = osw.load_entity(title)
+        with metrics.timer("osw_load_seconds"):
+            model_entity = osw.load_entity(title)
         #model_entity.uuid
         model_entity = model_entity.cast(model.BattmoModel)
-        for run in model_entity.workflow_runs:
-            if (run.status == "Item:OSWaa8d29404288446a9f3ec7afa4e2a512" # ToDo
-                and run.tool
-                and "Item:OSWb80747f1ccf340d790955572d27f678c" in run.tool # BattmoAtinaryOptimization
-               ):
-                m = model_entity
-                uuid = run.uuid
-                print(run.uuid)
-                break
+        for run in pending_runs(model_entity, BATTMO_OPTIMIZATION_TOOL):
+            m = model_entity
+            uuid = run.uuid
+            print(run.uuid)
+            break
     if (m):
         print(m.geometry)
+        seed = prior_observation(m) if request.warm_start else None
         
         result = run_geometry_optimization(request=BattmoOptimizationRequest(
             #geometry = m.geometry,
             uuid = uuid,
             #budget = 10,
-            random_seed = random.randint(1,1e6)
+            random_seed = random.randint(1,1e6),
+            # prior results can only be passed to the local optimizer
+            backend = "local" if request.warm_start else "sdlabs",
+            warm_start = request.warm_start,
+            seed_observations = [seed] if seed else [],
         ))
-        store_and_document_optimization_result(OptimizationResult(
+        store_and_document_optimization_result(osw, OptimizationResult(
             atinary_result = result,
             battmo_model = m
         ))
         #store_and_document_results.submit(wait_for=flowA)
-        
-@task()
-def create_bigmaparchive_record(model_entity: model.BattmoModel):
-    #url = "https://archive.big-map.eu/"
-    url = "https://big-map-archive-demo.materialscloud.org/"
 
-    # Navigate to 'Applications' > 'Personal access tokens' to create a token if necessary
-    token = Secret.load("big-map-archive-demo-api-key").get();
+@flow(validate_parameters=True) # validation will fail due to model.entity class
+def schedule_optimization_requests(request: OptimizationRequest):
+    with FlowMetrics("schedule_optimization_requests") as flow_metrics:
+        schedule_optimizations(request)
+    return flow_metrics.summary
+        
+# repository -> (publisher type, url, name of the Prefect Secret with the API token)
+PUBLISH_REPOSITORIES = {
+    "sandbox.zenodo.org": ("zenodo", "https://sandbox.zenodo.org", "zenodo-sandbox-api-token"),
+    #"archive.big-map.eu": ("invenio", "https://archive.big-map.eu", "big-map-archive-api-key"),
+    "big-map-archive-demo.materialscloud.org": ("invenio", "https://big-map-archive-demo.materialscloud.org", "big-map-archive-demo-api-key"),
+}
 
-    records_path = 'records'
-    links_filename = 'records_links.json'
-    
-    file_name = os.path.join(records_path, '0', str(model_entity.uuid) + '.json')
-    with open(file_name, "w", encoding="utf-8") as f:
-        f.write(model_entity.json(exclude_none=True))
-    
-    # Define the metadata that will be used on initial upload
+def _label_and_description(model_entity: model.BattmoModel):
     label = "BattMo Model" 
     if (model_entity.label and model_entity.label[0] and model_entity.label[0].text):
         label = model_entity.label[0].text
     description = "Demo data" 
     if (model_entity.description and model_entity.description[0] and model_entity.description[0].text): 
         description = model_entity.description[0].text
-    
-    data = {
+    return label, description
+
+def zenodo_metadata(model_entity: model.BattmoModel) -> dict:
+    label, description = _label_and_description(model_entity)
+    return {
+        "title": label,
+        "upload_type": "dataset",
+        "description": description,
+        "creators": [{"name": "Onterface Bot", "affiliation": "Onterface"}],
+    }
+
+def bigmap_metadata(model_entity: model.BattmoModel) -> dict:
+    label, description = _label_and_description(model_entity)
+    return {
       "access": {
         "record": "public",
         "files": "public"
@@ -243,129 +337,106 @@ def create_bigmaparchive_record(model_entity: model.BattmoModel):
         "version": "v1"
       }
     }
-    with open(os.path.join(records_path, '0', 'record_metadata.json'), "w", encoding="utf-8") as f:
-        f.write(json.dumps(data))
 
-    # Specify records that you want to upload:
-    # ('<record metadata json>.json', ['<datafile1>', '<datafile2>'])
+def _document_record(model_entity: model.BattmoModel, publisher_type: str, record):
+    if publisher_type == "zenodo":
+        model_entity.doi = record.doi
+    else:
+        if not model_entity.repository_records: model_entity.repository_records = []
+        model_entity.repository_records.append(model.Repository(
+            repository_name="BIG-MAP Archive",
+            record_pid=record.record_id,
+            record_link=record.link
+        ))
+
+def publish_entities(model_entities: List[model.BattmoModel], repository: str, url: Optional[str] = None, token: Optional[str] = None, max_workers: int = 4) -> dict:
+    """Publish every entity as a record with its json as file, concurrently over one keep-alive session.
+    The entities are updated with the record (doi or repository record), returns the errors by uuid"""
+    import publishing
+    if repository not in PUBLISH_REPOSITORIES:
+        raise ValueError(f"Unknown repository '{repository}', expected one of {list(PUBLISH_REPOSITORIES)}")
+    publisher_type, default_url, secret_name = PUBLISH_REPOSITORIES[repository]
+    if token is None:
+        token = Secret.load(secret_name).get()
+    metadata = zenodo_metadata if publisher_type == "zenodo" else bigmap_metadata
     records = [
-        ('record_metadata.json', [str(model_entity.uuid) + '.json'])
+        publishing.Record(
+            key=str(model_entity.uuid),
+            metadata=metadata(model_entity),
+            # uploaded from memory, nothing is written to the working directory
+            files=[publishing.RecordFile(str(model_entity.uuid) + '.json', model_entity.json(exclude_none=True).encode("utf-8"))]
+        )
+        for model_entity in model_entities
     ]
+    with publishing.create_session(max_workers) as session:
+        publisher = publishing.PUBLISHERS[publisher_type](session, url or default_url, token)
+        results = publishing.publish_all(publisher, records, max_workers)
+    errors = {}
+    for model_entity in model_entities:
+        record = results[str(model_entity.uuid)]
+        if isinstance(record, Exception):
+            errors[str(model_entity.uuid)] = str(record)
+            continue
+        print(f"Published {model_entity.uuid}: {record.link}")
+        _document_record(model_entity, publisher_type, record)
+    return errors
 
-    publish = True
-
-    logger = logging.getLogger()
-    logger.addHandler(logging.StreamHandler())
-    logger.setLevel(logging.INFO)
-
-    try:
-        prepare_output_file(records_path, links_filename)
-
-        record_index = 0
-        for record in records:
-            logger.info('----------Start uploading record ' + str(record_index) + '----------')
-            record_links = upload_record(url, records_path, record, record_index, token)
-
-            if publish:
-                # Publish the draft record
-                publish_record(record_links, token)
+def publish_models(osw: OSW, titles: List[str], repository: str, url: Optional[str] = None, token: Optional[str] = None, max_concurrency: int = 4) -> dict:
+    """Load, publish and store all models, returns the errors by uuid (or title if the page did not load)"""
+    errors = {}
+    models = load_models(osw, titles, max_concurrency, errors)
+    with WriteBack(osw, max_concurrency) as write_back:
+        for m in models:
+            write_back.track(m)
+        errors.update(publish_entities(models, repository, url, token, max_concurrency))
+        write_back.flush()
+    if errors:
+        print(f"{len(errors)} of {len(titles)} models were not published: {errors}")
+    return errors
 
-            # Save the record's links to a file
-            save_to_file(records_path, links_filename, record_links)
-
-            record_index += 1
-        logger.info('Uploading was successful. See the file records_links.json for links to the created records.')
-    except Exception as e:
-        logger.error('Error occurred: ' + str(e))
-    
-    print(record_links)
-    if not model_entity.repository_records: model_entity.repository_records = []
-    model_entity.repository_records.append(model.Repository(
-        repository_name="BIG-MAP Archive",
-        record_pid=record_links['record_html'].split('/')[-1],
-        record_link=record_links['record_html']
-    ))
+@task()
+def create_bigmaparchive_record(model_entity: model.BattmoModel):
+    errors = publish_entities([model_entity], "big-map-archive-demo.materialscloud.org")
+    if errors:
+        raise RuntimeError(f"Publishing to the BIG-MAP Archive failed: {errors}")
     return model_entity
         
 @task()
 def create_zenodo_record(model_entity: model.BattmoModel):
-    os.environ["ZENODO_SANDBOX_API_TOKEN"] = Secret.load("zenodo-sandbox-api-token").get();
-    
-    # Define the metadata that will be used on initial upload
-    label = "BattMo Model" 
-    if (model_entity.label and model_entity.label[0] and model_entity.label[0].text):
-        label = model_entity.label[0].text
-    description = "Demo data" 
-    if (model_entity.description and model_entity.description[0] and model_entity.description[0].text): 
-        description = model_entity.description[0].text
-    
-    file_name = str(model_entity.uuid) + '.json'
-    with open(file_name, "w", encoding="utf-8") as f:
-        f.write(model_entity.json(exclude_none=True))
-        
-    data = Metadata(
-        title=label,
-        upload_type='dataset',
-        description=description,
-        creators=[
-            Creator(
-                name='Onterface Bot',
-                affiliation='Onterface',
-            ),
-        ],
-    )
-    res = ensure_zenodo(
-        key=str(model_entity.uuid),  # this is a unique key you pick that will be used to store
-                      # the numeric deposition ID on your local system's cache
-        data=data,
-        paths=[
-            file_name,
-        ],
-        sandbox=True,  # remove this when you're ready to upload to real Zenodo
-    )
-    from pprint import pprint
-    res = res.json()
-    pprint(res)
-    model_entity.doi = res['doi']
+    errors = publish_entities([model_entity], "sandbox.zenodo.org")
+    if errors:
+        raise RuntimeError(f"Publishing to Zenodo failed: {errors}")
     return model_entity
         
 class PublishRequest(model.OswBaseModel):
     model_titles: List[str]
-    osw_instance: Optional[str] = "onterface.open-semantic-lab.org",
+    osw_instance: Optional[str] = "onterface.open-semantic-lab.org"
     repository: Optional[str] = "sandbox.zenodo.org"
+    max_concurrency: Optional[int] = 4 # records published at the same time
     
+def _publish(request: PublishRequest, flow_name: str) -> dict:
+    with FlowMetrics(flow_name) as flow_metrics:
+        connection = connect(ConnectionSettings(osw_domain=request.osw_instance))
+        osw = connection.osw
+        fetch_schema(connection)
+        errors = publish_models(osw, request.model_titles, request.repository, max_concurrency=request.max_concurrency)
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {len(request.model_titles)} models were not published: {errors}")
+    return flow_metrics.summary
+
 @flow() # validation will fail due to model.entity class
 def publish_results(request: PublishRequest):
-    
-    connect(ConnectionSettings(domain=request.osw_instance))
-    fetch_schema()
-    for title in request.model_titles:
-        model_entity = osw.load_entity(title)
-        #model_entity.uuid
-        model_entity = model_entity.cast(model.BattmoModel)
-       
-    if request.repository == "sandbox.zenodo.org": model_entity = create_zenodo_record(model_entity)
-
-    osw.store_entity(model_entity)
+    return _publish(request, "publish_results")
     
 class BigMapPublishRequest(model.OswBaseModel):
     model_titles: List[str]
-    osw_instance: Optional[str] = "onterface.open-semantic-lab.org",
+    osw_instance: Optional[str] = "onterface.open-semantic-lab.org"
     repository: Optional[str] = "big-map-archive-demo.materialscloud.org"
+    max_concurrency: Optional[int] = 4 # records published at the same time
     
 @flow()
 def publish_results_bigmap(request: BigMapPublishRequest):
-    
-    connect(ConnectionSettings(domain=request.osw_instance))
-    fetch_schema()
-    for title in request.model_titles:
-        model_entity = osw.load_entity(title)
-        #model_entity.uuid
-        model_entity = model_entity.cast(model.BattmoModel)
-       
-    if request.repository == "big-map-archive-demo.materialscloud.org": model_entity = create_bigmaparchive_record(model_entity)
-
-    osw.store_entity(model_entity)
+    return _publish(request, "publish_results_bigmap")
     
 if __name__ == "__main__":
     #schedule_pending_requests(SimulationRequest(
@@ -374,7 +445,7 @@ if __name__ == "__main__":
     #schedule_optimization_requests(OptimizationRequest(
     #    model_titles = ["Item:OSW57814a41a59c4411a6bd5f4f13009972"]
     #))
-    publish_results(OptimizationRequest(
+    publish_results(PublishRequest(
         model_titles = ["Item:OSWa600b56fa5c1453aa62e0b867ee9d42f"]
     ))
     #publish_results_bigmap(BigMapPublishRequest(
@@ -0,0 +1,248 @@
+# Bulk publishing of records to Zenodo and to InvenioRDM based archives (BIG-MAP Archive).
+# All uploads share one keep-alive requests.Session with a connection pool sized to the worker
+# pool, files are uploaded from memory (no temporary files) and records are published
+# concurrently. Every HTTP call is retried with exponential backoff on connection errors and
+# transient status codes; a record that still fails is reported without stopping the others.
+# Calls that create something (depositions, versions, drafts, published records) are only retried
+# if the server did not process them, a timeout could otherwise create duplicates.
+# Like zenodo_client's ensure_zenodo, the Zenodo deposition of every record key is remembered
+# locally, publishing a key again creates a new version of its deposition or reuses the draft
+# a failed publish left open.
+# Configuration via environment variables:
+#   BATTMO_ZENODO_DEPOSITIONS   json file with the deposition id by record key (default: ~/.cache/battmo_prefect/zenodo_depositions.json)
+
+import abc
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+ZENODO_SANDBOX_URL = "https://sandbox.zenodo.org"
+BIGMAP_ARCHIVE_DEMO_URL = "https://big-map-archive-demo.materialscloud.org"
+
+# status codes worth a retry
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+# status codes of requests the server did not process, safe to retry for creating calls
+NOT_PROCESSED_STATUS = {429, 503}
+
+
+class RecordFile(NamedTuple):
+    name: str
+    content: bytes
+
+
+class Record(NamedTuple):
+    key: str # caller's id of the record, e.g. the entity uuid
+    metadata: Dict
+    files: List[RecordFile]
+
+
+class PublishedRecord(NamedTuple):
+    key: str
+    record_id: str
+    link: str
+    doi: Optional[str] = None
+
+
+def create_session(pool_size: int = 8) -> requests.Session:
+    """Session with a keep-alive connection pool for pool_size concurrent uploads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class DepositionIndex:
+    """Persistent record key -> deposition id map per repository url, thread safe"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, int]]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, url: str, key: str) -> Optional[int]:
+        with self._lock:
+            return self._load().get(url, {}).get(key)
+
+    def set(self, url: str, key: str, deposition_id: int):
+        with self._lock:
+            depositions = self._load()
+            depositions.setdefault(url, {})[key] = deposition_id
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(depositions, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+_depositions: Optional[DepositionIndex] = None
+_depositions_lock = threading.Lock()
+
+
+def get_deposition_index() -> DepositionIndex:
+    """Return the process wide deposition index, created on first use"""
+    global _depositions
+    with _depositions_lock:
+        if _depositions is None:
+            _depositions = DepositionIndex(
+                os.environ.get(
+                    "BATTMO_ZENODO_DEPOSITIONS",
+                    os.path.join(os.path.expanduser("~"), ".cache", "battmo_prefect", "zenodo_depositions.json"),
+                )
+            )
+        return _depositions
+
+
+class Publisher(abc.ABC):
+    """Creates, uploads and publishes one record per call of publish(), thread safe"""
+
+    repository = "archive"
+
+    def __init__(self, session: requests.Session, url: str, token: str, retries: int = 4, backoff_s: float = 1.0, timeout_s: float = 60):
+        self.session = session
+        self.url = url.rstrip("/")
+        self.token = token
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.timeout_s = timeout_s
+
+    def _call(self, method: str, url: str, idempotent: bool = True, **kwargs) -> Dict:
+        """JSON response of an HTTP call, retried with exponential backoff and jitter.
+        Non idempotent calls are only retried if the request was not processed."""
+        retry_status = RETRY_STATUS if idempotent else NOT_PROCESSED_STATUS
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, url, timeout=self.timeout_s, **kwargs)
+                if response.status_code not in retry_status:
+                    response.raise_for_status()
+                    return response.json() if response.content else {}
+                error = f"HTTP {response.status_code}"
+            except requests.ConnectTimeout as e:
+                # not connected, nothing was sent
+                error = str(e)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not idempotent:
+                    raise RuntimeError(f"{method} {url} failed, not retried as it may have been processed: {e}")
+                error = str(e)
+            if attempt == self.retries:
+                raise RuntimeError(f"{method} {url} failed after {attempt + 1} attempts: {error}")
+            metrics.inc("publish_retries_total", repository=self.repository)
+            time.sleep(random.uniform(0, self.backoff_s * 2 ** attempt))
+
+    def _upload(self, method: str, url: str, content: bytes, **kwargs) -> Dict:
+        metrics.observe("upload_bytes", len(content), repository=self.repository)
+        headers = dict(kwargs.pop("headers", {}), **{"Content-Type": "application/octet-stream"})
+        return self._call(method, url, data=content, headers=headers, **kwargs)
+
+    @abc.abstractmethod
+    def publish(self, record: Record) -> PublishedRecord:
+        ...
+
+
+class ZenodoPublisher(Publisher):
+    """Zenodo deposition API: create a deposition (or a new version of the deposition of the
+    record key), upload files to its bucket, publish"""
+
+    repository = "zenodo"
+
+    def __init__(self, *args, depositions: Optional[DepositionIndex] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.depositions = depositions or get_deposition_index()
+
+    def _draft(self, deposition_id: int, record: Record, params: Dict) -> Dict:
+        """Open draft of the deposition of the record key, without files: the deposition itself if it
+        was never published, the draft a failed publish left open (Zenodo allows one per record)
+        or a new version"""
+        deposition = self._call("GET", f"{self.url}/api/deposit/depositions/{deposition_id}", params=params)
+        draft = deposition if not deposition.get("submitted", True) else None
+        if draft is None and deposition["links"].get("latest_draft"):
+            draft = self._call("GET", deposition["links"]["latest_draft"], params=params)
+            draft = draft if not draft.get("submitted", True) else None
+        if draft is None:
+            deposition = self._call(
+                "POST", f"{self.url}/api/deposit/depositions/{deposition_id}/actions/newversion", idempotent=False, params=params
+            )
+            draft = self._call("GET", deposition["links"]["latest_draft"], params=params)
+        # files are carried over from the previous version or left by a failed upload, the record brings its own
+        for file in draft.get("files", []):
+            self._call("DELETE", file["links"]["self"], params=params)
+        return self._call("PUT", draft["links"]["self"], params=params, json={"metadata": record.metadata})
+
+    def publish(self, record: Record) -> PublishedRecord:
+        params = {"access_token": self.token}
+        deposition_id = self.depositions.get(self.url, record.key)
+        if deposition_id is None:
+            deposition = self._call(
+                "POST", f"{self.url}/api/deposit/depositions", idempotent=False, params=params, json={"metadata": record.metadata}
+            )
+            # remembered before the upload, a failed publish leaves a draft that is reused next time
+            self.depositions.set(self.url, record.key, deposition["id"])
+        else:
+            deposition = self._draft(deposition_id, record, params)
+        for file in record.files:
+            self._upload("PUT", f"{deposition['links']['bucket']}/{file.name}", file.content, params=params)
+        published = self._call("POST", deposition["links"]["publish"], idempotent=False, params=params)
+        self.depositions.set(self.url, record.key, published.get("id", deposition["id"]))
+        links = published.get("links", {})
+        return PublishedRecord(
+            key=record.key,
+            record_id=str(published.get("id", deposition["id"])),
+            link=links.get("record_html") or links.get("html") or deposition["links"].get("html"),
+            doi=published.get("doi"),
+        )
+
+
+class InvenioPublisher(Publisher):
+    """InvenioRDM records API: create draft, register, upload and commit files, publish"""
+
+    repository = "bigmap"
+
+    def publish(self, record: Record) -> PublishedRecord:
+        headers = {"Authorization": f"Bearer {self.token}"}
+        draft = self._call("POST", f"{self.url}/api/records", idempotent=False, headers=headers, json=record.metadata)
+        if record.files:
+            entries = self._call(
+                "POST", draft["links"]["files"], headers=headers, json=[{"key": file.name} for file in record.files]
+            )["entries"]
+            links = {entry["key"]: entry["links"] for entry in entries}
+            for file in record.files:
+                self._upload("PUT", links[file.name]["content"], file.content, headers=headers)
+                self._call("POST", links[file.name]["commit"], headers=headers)
+        published = self._call("POST", draft["links"]["publish"], idempotent=False, headers=headers)
+        link = published.get("links", {}).get("self_html") or draft["links"].get("self_html")
+        return PublishedRecord(key=record.key, record_id=str(published.get("id", draft["id"])), link=link, doi=published.get("pids", {}).get("doi", {}).get("identifier"))
+
+
+PUBLISHERS = {
+    "zenodo": ZenodoPublisher,
+    "invenio": InvenioPublisher,
+}
+
+
+def publish_all(publisher: Publisher, records: List[Record], max_workers: int = 4) -> Dict[str, Union[PublishedRecord, Exception]]:
+    """Publish all records concurrently, returns the published record or the error by record key"""
+    def publish(record: Record):
+        try:
+            with metrics.timer("publish_record_seconds", repository=publisher.repository):
+                return publisher.publish(record)
+        except Exception as e:
+            print(f"Publishing {record.key} to {publisher.repository} failed: {e}")
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(records) or 1))) as executor:
+        return {record.key: result for record, result in zip(records, executor.map(publish, records))}
@@ -0,0 +1,274 @@
+# Content addressed cache for BattMo simulation results.
+# Results are stored as one json file per key on disk, with an in-process LRU in front of it.
+# An evicted entry takes its trajectory file along, the size limit counts the json files only.
+# Configuration via environment variables:
+#   BATTMO_CACHE_DIR            cache directory (default: ~/.cache/battmo_prefect/results)
+#   BATTMO_CACHE_MAX_BYTES      evict least recently used entries above this size (default: 1 GB, 0 = no limit)
+#   BATTMO_CACHE_MAX_ENTRIES    evict least recently used entries above this count (default: 0 = no limit)
+#   BATTMO_CACHE_MAX_AGE_DAYS   entries older than this are ignored and evicted (default: 90, 0 = no limit)
+#   BATTMO_VERSION              overrides the BattMo version otherwise read from the BattMo git checkout
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from octave_pool import BATTMO_HOME
+
+EVICT_EVERY_N_PUTS = 100
+
+
+def _canonical(value: Any) -> Any:
+    # normalize numbers so that 6.4e-05, 6.40000000000001e-05 and 64e-6 map onto the same key
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(f"{float(value):.12g}") + 0.0  # + 0.0 maps -0.0 to 0.0
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return str(value)
+
+
+def geometry_hash(geometry: Dict) -> str:
+    """sha256 of the canonical json representation of a geometry dict"""
+    canonical = json.dumps(_canonical(geometry), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+_file_hashes: Dict[str, tuple] = {}
+
+
+def file_hash(path: str) -> str:
+    """sha256 of a file's content, memoized by path, size and mtime"""
+    stat = os.stat(path)
+    cached = _file_hashes.get(path)
+    if cached and cached[0] == (stat.st_size, stat.st_mtime_ns):
+        return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _file_hashes[path] = ((stat.st_size, stat.st_mtime_ns), digest)
+    return digest
+
+
+def battmo_version(battmo_home: str = BATTMO_HOME) -> str:
+    """Commit id of the BattMo checkout, 'unknown' if it can't be determined"""
+    if os.environ.get("BATTMO_VERSION"):
+        return os.environ["BATTMO_VERSION"]
+    git_dir = os.path.join(battmo_home, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head[5:]
+        ref_file = os.path.join(git_dir, ref)
+        if os.path.exists(ref_file):
+            with open(ref_file) as f:
+                return f.read().strip()
+        with open(os.path.join(git_dir, "packed-refs")) as f:
+            for line in f:
+                if line.rstrip().endswith(" " + ref):
+                    return line.split()[0]
+    except OSError:
+        pass
+    return "unknown"
+
+
+def cache_key(geometry: Dict, base_parameter_path: str, version: Optional[str] = None, variant: Optional[str] = None) -> str:
+    """Key of a simulation: geometry, base parameter file content and BattMo version.
+    Results computed differently (e.g. the step-wise energy density of prunable runs) pass a variant."""
+    parts = [
+        geometry_hash(geometry),
+        file_hash(base_parameter_path) if os.path.exists(base_parameter_path) else base_parameter_path,
+        version or battmo_version(),
+    ]
+    if variant:
+        parts.append(variant)
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Persistent key -> result dict store with size and age based eviction"""
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 1 << 30,
+        max_entries: int = 0,
+        max_age_s: float = 90 * 24 * 3600,
+        memory_entries: int = 1024,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_age_s = max_age_s
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.max_age_s) and time.time() - created > self.max_age_s
+
+    def _remember(self, key: str, entry: Dict):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry["created"]):
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+            else:
+                entry = None
+        if entry is not None:
+            # memory hits are uses as well, otherwise the most used entries look least recently used on disk
+            self._touch(key, entry)
+            return entry["result"]
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        with self._lock:
+            if entry is None or self._expired(entry["created"]):
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self._remember(key, entry)
+        self._touch(key, entry)
+        return entry["result"]
+
+    def _touch(self, key: str, entry: Dict):
+        try:
+            # atime tracks the last use for LRU eviction, mtime stays the creation time
+            os.utime(self._path(key), (time.time(), entry["created"]))
+        except OSError:
+            pass
+
+    def put(self, key: str, geometry: Dict, result: Dict):
+        entry = {"key": key, "created": time.time(), "geometry": geometry, "result": result}
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, default=str)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._remember(key, entry)
+            self.counters["stores"] += 1
+            self._puts += 1
+            evict = self._puts % EVICT_EVERY_N_PUTS == 0
+        if evict:
+            self.evict()
+
+    def entries(self) -> List[Dict]:
+        """All valid entries on disk (used to reuse prior results)"""
+        result = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(root, name), encoding="utf-8") as f:
+                        entry = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if not self._expired(entry["created"]):
+                    result.append(entry)
+        return result
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones above max_entries / max_bytes"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".tmp"):
+                    # leftovers of interrupted writes
+                    if time.time() - stat.st_mtime > 3600:
+                        self._remove(path)
+                    continue
+                files.append((stat.st_atime, stat.st_mtime, stat.st_size, path))
+        files.sort()  # least recently used first
+        keep = []
+        for atime, mtime, size, path in files:
+            if self._expired(mtime):
+                self._remove(path)
+            else:
+                keep.append((size, path))
+        total = sum(size for size, _ in keep)
+        count = len(keep)
+        for size, path in keep:
+            over_bytes = self.max_bytes and total > self.max_bytes
+            over_entries = self.max_entries and count > self.max_entries
+            if not (over_bytes or over_entries):
+                break
+            self._remove(path)
+            total -= size
+            count -= 1
+
+    def _remove(self, path: str):
+        trajectory = None
+        if path.endswith(".json"):
+            # the trajectory file of the entry (see trajectory_store) goes with it
+            try:
+                with open(path, encoding="utf-8") as f:
+                    trajectory = json.load(f)["result"].get("trajectory")
+            except (OSError, ValueError, KeyError, AttributeError):
+                pass
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        if trajectory:
+            try:
+                os.remove(trajectory)
+            except OSError:
+                pass
+        key = os.path.basename(path)[: -len(".json")]
+        with self._lock:
+            self._memory.pop(key, None)
+            self.counters["evictions"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters, memory_entries=len(self._memory))
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResultCache:
+    """Return the process wide result cache, created on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                directory=os.environ.get(
+                    "BATTMO_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "battmo_prefect", "results")
+                ),
+                max_bytes=int(os.environ.get("BATTMO_CACHE_MAX_BYTES", 1 << 30)),
+                max_entries=int(os.environ.get("BATTMO_CACHE_MAX_ENTRIES", 0)),
+                max_age_s=float(os.environ.get("BATTMO_CACHE_MAX_AGE_DAYS", 90)) * 24 * 3600,
+            )
+        return _cache
@@ -0,0 +1,116 @@
+# Space filling designs on the unit hypercube, shared by the local optimizer and parameter sweeps.
+# All functions return an (n, d) array with values in [0, 1).
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Joe & Kuo direction numbers (new-joe-kuo-6.21201) for dimensions 2..8: (s, a, m_1..m_s)
+_SOBOL_DIRECTIONS = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+]
+_SOBOL_BITS = 30
+SOBOL_MAX_DIMENSIONS = len(_SOBOL_DIRECTIONS) + 1
+
+
+def _sobol_direction_vectors(d: int) -> np.ndarray:
+    v = np.zeros((d, _SOBOL_BITS + 1), dtype=np.int64)
+    for k in range(1, _SOBOL_BITS + 1):
+        v[0, k] = 1 << (_SOBOL_BITS - k)
+    for j in range(1, d):
+        s, a, m = _SOBOL_DIRECTIONS[j - 1]
+        for k in range(1, _SOBOL_BITS + 1):
+            if k <= s:
+                v[j, k] = m[k - 1] << (_SOBOL_BITS - k)
+            else:
+                value = v[j, k - s] ^ (v[j, k - s] >> s)
+                for i in range(1, s):
+                    if (a >> (s - 1 - i)) & 1:
+                        value ^= v[j, k - i]
+                v[j, k] = value
+    return v
+
+
+def sobol(n: int, d: int, seed: Optional[int] = None) -> np.ndarray:
+    """Sobol sequence (Gray code construction), randomized by a digital shift if seed is given.
+    The leading all-zero point is skipped."""
+    if d > SOBOL_MAX_DIMENSIONS:
+        raise ValueError(f"Sobol sequence supports at most {SOBOL_MAX_DIMENSIONS} dimensions")
+    v = _sobol_direction_vectors(d)
+    shift = np.zeros(d, dtype=np.int64)
+    if seed is not None:
+        shift = np.random.default_rng(seed).integers(0, 1 << _SOBOL_BITS, size=d, dtype=np.int64)
+    points = np.empty((n, d))
+    x = np.zeros(d, dtype=np.int64)
+    for i in range(1, n + 1):
+        # index of the rightmost zero bit of i - 1
+        c = 1
+        value = i - 1
+        while value & 1:
+            value >>= 1
+            c += 1
+        x ^= v[:, c]
+        points[i - 1] = (x ^ shift) / float(1 << _SOBOL_BITS)
+    return points
+
+
+def latin_hypercube(n: int, d: int, seed: Optional[int] = None) -> np.ndarray:
+    """One point per stratum and dimension, randomly paired and jittered within the strata"""
+    rng = np.random.default_rng(seed)
+    strata = np.argsort(rng.random((n, d)), axis=0)
+    return (strata + rng.random((n, d))) / n
+
+
+def uniform_random(n: int, d: int, seed: Optional[int] = None) -> np.ndarray:
+    return np.random.default_rng(seed).random((n, d))
+
+
+def grid(n: int, d: int, seed: Optional[int] = None, levels: Optional[List[int]] = None) -> np.ndarray:
+    """Full factorial grid with cell centered levels, at least n points unless levels are given.
+    With a seed the points are returned in random order, otherwise in lexicographic order."""
+    if levels is None:
+        k = max(1, int(np.ceil(n ** (1.0 / d) - 1e-9)))
+        levels = [k] * d
+    axes = [(np.arange(k) + 0.5) / k for k in levels]
+    points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, d)
+    if seed is not None:
+        points = points[np.random.default_rng(seed).permutation(len(points))]
+    return points
+
+
+DESIGNS = {
+    "sobol": sobol,
+    "latinhypercube": latin_hypercube,
+    "randomsearch": uniform_random,
+    "grid": grid,
+}
+
+
+def design(method: str, n: int, d: int, seed: Optional[int] = None) -> np.ndarray:
+    """n points of the named design in the unit hypercube"""
+    if method not in DESIGNS:
+        raise ValueError(f"Unknown design '{method}', expected one of {list(DESIGNS)}")
+    return DESIGNS[method](n, d, seed)
+
+
+def scale(unit_points: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """Map points from the unit hypercube onto [low, high]"""
+    return low + unit_points * (high - low)
+
+
+def unscale(points: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    return (points - low) / (high - low)
+
+
+def bounds(parameters: List[Dict]) -> tuple:
+    """(names, low, high) of a parameter list in the optimization config format"""
+    names = [p["name"] for p in parameters]
+    low = np.array([p["low_value"] for p in parameters], dtype=float)
+    high = np.array([p["high_value"] for p in parameters], dtype=float)
+    return names, low, high
@@ -0,0 +1,128 @@
+# On-disk cache of the python model generated from OSW category schemas.
+# osw.fetch_schema downloads the schemas and runs datamodel-codegen, which takes far longer
+# than a short scheduling flow. The generated osw.model.entity module is stored keyed by the
+# category list and the revision ids of the category pages. Within the TTL nothing is
+# checked; afterwards one request for the current revision ids decides whether the cached
+# model is still valid, and codegen only runs when a schema actually changed.
+# Configuration via environment variables:
+#   OSW_SCHEMA_CACHE_DIR        cache directory (default: ~/.cache/battmo_prefect/schemas)
+#   OSW_SCHEMA_TTL_S            seconds between revision checks (default: 3600)
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from importlib import reload
+from types import ModuleType
+from typing import Callable, Dict, List, Optional
+
+_lock = threading.Lock()
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_sha256(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return _sha256(f.read())
+    except OSError:
+        return None
+
+
+def revision_ids(wtsite, titles: List[str]) -> Dict[str, int]:
+    """Current revision id of each page, fetched with a single API request"""
+    result = wtsite._site.api("query", prop="revisions", titles="|".join(titles), rvprop="ids")
+    revisions = {}
+    for page in result["query"]["pages"].values():
+        if page.get("revisions"):
+            revisions[page["title"]] = page["revisions"][0]["revid"]
+    return revisions
+
+
+class SchemaCache:
+    """Keeps the generated model module in sync with the category schemas"""
+
+    def __init__(self, directory: str, ttl_s: float = 3600):
+        self.directory = directory
+        self.ttl_s = ttl_s
+        self.state_file = os.path.join(directory, "state.json")
+        os.makedirs(directory, exist_ok=True)
+
+    def _load_state(self) -> Dict:
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state: Dict):
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def ensure(
+        self,
+        categories: List[str],
+        wtsite,
+        generate: Callable[[List[str]], None],
+        model_module: ModuleType,
+    ) -> bool:
+        """Make model_module match the schemas of the categories, returns True if it was replaced.
+        generate(categories) runs the codegen that rewrites the module file."""
+        if not categories:
+            return False
+        module_file = model_module.__file__
+        categories_key = _sha256(json.dumps(categories).encode("utf-8"))
+        with _lock:
+            state = self._load_state()
+            fresh = time.time() - state.get("checked", 0) < self.ttl_s
+            if fresh and state.get("categories_key") == categories_key and state.get("module_sha256") == _file_sha256(module_file):
+                return False
+
+            revisions = revision_ids(wtsite, categories)
+            key = _sha256(json.dumps([categories, [revisions.get(c) for c in categories]]).encode("utf-8"))
+            cached_file = os.path.join(self.directory, key + ".py")
+            changed = False
+            if os.path.exists(cached_file):
+                if _file_sha256(cached_file) != _file_sha256(module_file):
+                    print(f"Restoring cached model {key}")
+                    shutil.copyfile(cached_file, module_file)
+                    changed = True
+            else:
+                print(f"Schemas changed, regenerating model for {categories}")
+                generate(categories)
+                shutil.copyfile(module_file, cached_file)
+                changed = True
+            if changed:
+                reload(model_module)
+            self._save_state(
+                {
+                    "categories_key": categories_key,
+                    "key": key,
+                    "revisions": revisions,
+                    "checked": time.time(),
+                    "module_sha256": _file_sha256(module_file),
+                }
+            )
+            return changed
+
+
+_cache: Optional[SchemaCache] = None
+
+
+def get_schema_cache() -> SchemaCache:
+    """Return the process wide schema cache, created on first use"""
+    global _cache
+    if _cache is None:
+        _cache = SchemaCache(
+            os.environ.get(
+                "OSW_SCHEMA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "battmo_prefect", "schemas")
+            ),
+            ttl_s=float(os.environ.get("OSW_SCHEMA_TTL_S", 3600)),
+        )
+    return _cache
@@ -0,0 +1,63 @@
+# Surrogate pre-screening of optimizer suggestions.
+# A Gaussian process on the (unit scaled) optimization parameters is fitted on past results,
+# candidates whose upper confidence bound is below the incumbent are not worth a simulation.
+
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+import sampling
+from gaussian_process import GaussianProcess
+
+
+class ScreeningDecision(NamedTuple):
+    simulate: bool
+    predicted: Optional[float]
+    upper_bound: Optional[float]
+    lower_bound: Optional[float] = None
+
+
+class SurrogateScreen:
+    """Bulk scoring of candidate points against the incumbent (maximization)"""
+
+    def __init__(self, parameters: List[Dict], kappa: float = 2.0, min_points: int = 5, max_points: int = 500):
+        self.names, self.low, self.high = sampling.bounds(parameters)
+        self.kappa = kappa
+        self.min_points = min_points
+        self.max_points = max_points
+        self._x: List[np.ndarray] = []
+        self._y: List[float] = []
+        self._gp: Optional[GaussianProcess] = None
+
+    def _point(self, param_values: Dict[str, float]) -> np.ndarray:
+        values = np.array([param_values[name] for name in self.names], dtype=float)
+        return sampling.unscale(values, self.low, self.high)
+
+    def add(self, param_values: Dict[str, float], value: float):
+        point = self._point(param_values)
+        if np.any(point < 0.0) or np.any(point > 1.0):
+            return
+        self._x.append(point)
+        self._y.append(float(value))
+        self._gp = None
+
+    def __len__(self) -> int:
+        return len(self._y)
+
+    def screen(self, candidates: List[Dict[str, float]], incumbent: Optional[float]) -> List[ScreeningDecision]:
+        """Decide for every candidate whether to simulate it. Without incumbent or with too
+        little data every candidate is simulated."""
+        if incumbent is None or len(self._y) < self.min_points or not candidates:
+            return [ScreeningDecision(True, None, None) for _ in candidates]
+        if self._gp is None:
+            # the most recent results are the most relevant ones if the history is long
+            x = np.array(self._x[-self.max_points :])
+            y = np.array(self._y[-self.max_points :])
+            self._gp = GaussianProcess(noise=1e-4).fit(x, y)
+        mean, std = self._gp.predict(np.array([self._point(candidate) for candidate in candidates]))
+        upper = mean + self.kappa * std
+        lower = mean - self.kappa * std
+        return [
+            ScreeningDecision(bool(upper[i] >= incumbent), float(mean[i]), float(upper[i]), float(lower[i]))
+            for i in range(len(candidates))
+        ]
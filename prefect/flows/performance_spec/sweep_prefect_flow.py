@@ -0,0 +1,190 @@
+# Parameter sweeps over the Geometry1D fields.
+# The design matrix is generated with numpy (see sampling), duplicate points are removed and
+# the points are simulated in chunks (one octave call per chunk) with bounded parallelism.
+# Every finished chunk is written as a columnar part file <output_dir>/part-<n>.npz (atomic
+# rename), load_sweep(output_dir) reads all parts written so far, also while the sweep runs.
+# A sweep restarted with the same output_dir (and the same design, set random_seed for random
+# designs) only simulates the points that are missing.
+# Configuration via environment variables:
+#   BATTMO_SWEEP_DIR            parent directory of sweep outputs (default: ~/.cache/battmo_prefect/sweeps)
+
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from uuid import UUID, uuid4
+
+import numpy as np
+from prefect import flow
+from pydantic import BaseModel, Field
+
+import battmo_prefect_flow as battmo
+import sampling
+from metrics import FlowMetrics
+
+# sweep parameter name -> path of the field in the Geometry1D dict
+SWEEP_FIELDS = {
+    "negative_electrode_thickness": ("NegativeElectrode", "ActiveMaterial", "thickness"),
+    "positive_electrode_thickness": ("PositiveElectrode", "ActiveMaterial", "thickness"),
+    "separator_thickness": ("Electrolyte", "Separator", "thickness"),
+    "face_area": ("faceArea",),
+}
+RESULT_FIELDS = ("E", "energyDensity", "energy")
+
+
+class SweepParameter(BaseModel):
+    name: str # one of SWEEP_FIELDS
+    low_value: float
+    high_value: float
+    levels: Optional[int] = None # number of grid levels, only used by the grid design
+
+
+class SweepRequest(BaseModel):
+    uuid: UUID = Field(default_factory=uuid4, title="UUID")
+    parameters: List[SweepParameter] # swept fields, the others keep the value of geometry
+    geometry: Optional[battmo.Geometry1D] = battmo.Geometry1D()
+    method: Optional[str] = "sobol" # see sampling.DESIGNS
+    n_points: Optional[int] = 256
+    random_seed: Optional[int] = None
+    chunk_size: Optional[int] = 32 # geometries per octave call
+    max_workers: Optional[int] = 4 # chunks simulated at the same time
+    use_cache: Optional[bool] = True
+    output_dir: Optional[str] = None # default: BATTMO_SWEEP_DIR/<uuid>
+
+
+class SweepResult(BaseModel):
+    uuid: UUID
+    output_dir: str
+    points: int # unique points of the design
+    simulated: int # points simulated in this run, the others were done before
+    ok: int
+    failed: int
+    metrics: Optional[Dict] = None # stage timings and counts of the flow run, see metrics.FlowMetrics
+
+
+def default_output_dir(uuid: UUID) -> str:
+    directory = os.environ.get("BATTMO_SWEEP_DIR", os.path.join(os.path.expanduser("~"), ".cache", "battmo_prefect", "sweeps"))
+    return os.path.join(directory, str(uuid))
+
+
+def design_matrix(request: SweepRequest) -> np.ndarray:
+    """(n, d) array of unique points in parameter units, in design order"""
+    names = [p.name for p in request.parameters]
+    unknown = [name for name in names if name not in SWEEP_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters {unknown}, expected some of {list(SWEEP_FIELDS)}")
+    low = np.array([p.low_value for p in request.parameters], dtype=float)
+    high = np.array([p.high_value for p in request.parameters], dtype=float)
+    d = len(names)
+    if request.method == "grid" and any(p.levels for p in request.parameters):
+        levels = [p.levels or 1 for p in request.parameters]
+        unit_points = sampling.grid(request.n_points, d, request.random_seed, levels=levels)
+    else:
+        unit_points = sampling.design(request.method, request.n_points, d, request.random_seed)
+    # points that only differ by float noise are simulated once
+    _, first = np.unique(np.round(unit_points, 9), axis=0, return_index=True)
+    return sampling.scale(unit_points[np.sort(first)], low, high)
+
+
+def _geometry(base: Dict, names: List[str], point: np.ndarray) -> battmo.Geometry1D:
+    geometry = {key: dict(value) if isinstance(value, dict) else value for key, value in base.items()}
+    for name, value in zip(names, point):
+        path = SWEEP_FIELDS[name]
+        node = geometry
+        for key in path[:-1]:
+            node[key] = dict(node[key])
+            node = node[key]
+        node[path[-1]] = float(value)
+    return battmo.Geometry1D.parse_obj(geometry)
+
+
+def _write_part(output_dir: str, part: int, columns: Dict[str, np.ndarray]):
+    path = os.path.join(output_dir, f"part-{part:05d}.npz")
+    tmp_path = os.path.join(output_dir, f".part-{part:05d}.npz.tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **columns)
+    os.replace(tmp_path, path)
+
+
+def load_sweep(output_dir: str) -> Dict[str, np.ndarray]:
+    """Columns of all results written so far, one row per point sorted by point index.
+    Columns: index, the swept parameters, E, energyDensity, energy, status, trajectory."""
+    parts = []
+    for path in sorted(glob.glob(os.path.join(output_dir, "part-*.npz"))):
+        with np.load(path) as part:
+            parts.append({name: part[name] for name in part.files})
+    if not parts:
+        return {}
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    # a point retried after a failure has several rows, the last one written counts
+    _, last = np.unique(columns["index"][::-1], return_index=True)
+    rows = len(columns["index"]) - 1 - last
+    return {name: values[rows] for name, values in columns.items()}
+
+
+def sweep(request: SweepRequest) -> SweepResult:
+    """Run a sweep outside of a flow run"""
+    output_dir = request.output_dir or default_output_dir(request.uuid)
+    os.makedirs(output_dir, exist_ok=True)
+    names = [p.name for p in request.parameters]
+    points = design_matrix(request)
+
+    done = load_sweep(output_dir)
+    # failed points are simulated again
+    done_indices = set(done["index"][done["status"] == "ok"].tolist()) if done else set()
+    todo = np.array([i for i in range(len(points)) if i not in done_indices], dtype=np.int64)
+    part = len(glob.glob(os.path.join(output_dir, "part-*.npz")))
+    print(f"Sweep {request.uuid}: {len(points)} points, {len(done_indices)} done, output {output_dir}")
+
+    base = request.geometry.dict()
+    chunk_size = max(1, request.chunk_size)
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+
+    def run(chunk: np.ndarray) -> battmo.PerformanceSpecBatchResponse:
+        requests = [
+            battmo.PerformanceSpecRequest(geometry=_geometry(base, names, points[i]), use_cache=request.use_cache, priority="batch")
+            for i in chunk
+        ]
+        return battmo.simulate_performance_spec_batch(requests)
+
+    ok = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, request.max_workers)) as executor:
+        futures = {executor.submit(run, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                response = future.result()
+                status = np.array(response.status, dtype=str)
+                results = {
+                    name: np.array([np.nan if v is None else v for v in getattr(response, name)], dtype=float)
+                    for name in RESULT_FIELDS
+                }
+                trajectory = np.array([t or "" for t in response.trajectory], dtype=str)
+            except Exception as e:
+                print(f"Sweep chunk failed: {e}")
+                status = np.full(len(chunk), f"error: {e}")
+                results = {name: np.full(len(chunk), np.nan) for name in RESULT_FIELDS}
+                trajectory = np.full(len(chunk), "")
+            columns = {"index": chunk}
+            columns.update({name: points[chunk, j] for j, name in enumerate(names)})
+            columns.update(results)
+            columns["status"] = status
+            columns["trajectory"] = trajectory
+            _write_part(output_dir, part, columns)
+            part += 1
+            n_ok = int(np.count_nonzero(status == "ok"))
+            ok += n_ok
+            failed += len(chunk) - n_ok
+            print(f"Sweep {request.uuid}: {ok + failed}/{len(todo)} simulated")
+
+    return SweepResult(
+        uuid=request.uuid, output_dir=output_dir, points=len(points), simulated=len(todo), ok=ok, failed=failed
+    )
+
+
+@flow
+def run_sweep(request: SweepRequest) -> SweepResult:
+    with FlowMetrics("run_sweep") as flow_metrics:
+        result = sweep(request)
+    result.metrics = flow_metrics.summary
+    return result
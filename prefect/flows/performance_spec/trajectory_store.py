@@ -0,0 +1,63 @@
+# Compact binary store for full discharge trajectories of BattMo simulations.
+# Every trajectory is one .npy file holding a structured array (one field per series),
+# which can be memory-mapped and sliced without loading or parsing the whole file.
+# Configuration via environment variables:
+#   BATTMO_TRAJECTORY_DIR       store directory (default: ~/.cache/battmo_prefect/trajectories)
+
+import os
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+TRAJECTORY_FIELDS = ("E", "energyDensity", "energy")
+
+
+class TrajectoryStore:
+    """Stores named time series of equal length as memory-mappable structured .npy files"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".npy")
+
+    def save(self, key: str, series: Dict[str, np.ndarray]) -> str:
+        """Store the series under key and return the file path.
+        Shorter series are padded with NaN to the length of the longest one."""
+        columns = {name: np.asarray(values, dtype=np.float64).ravel() for name, values in series.items()}
+        length = max((len(values) for values in columns.values()), default=0)
+        table = np.full(length, np.nan, dtype=[(name, np.float64) for name in columns])
+        for name, values in columns.items():
+            table[name][: len(values)] = values
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, table)
+        os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    def load(path: str, mmap: bool = True) -> np.ndarray:
+        """Structured array of a stored trajectory, e.g. load(path)["energyDensity"][-10:]"""
+        return np.load(path, mmap_mode="r" if mmap else None)
+
+
+_store: Optional[TrajectoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_trajectory_store() -> TrajectoryStore:
+    """Return the process wide trajectory store, created on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TrajectoryStore(
+                os.environ.get(
+                    "BATTMO_TRAJECTORY_DIR",
+                    os.path.join(os.path.expanduser("~"), ".cache", "battmo_prefect", "trajectories"),
+                )
+            )
+        return _store
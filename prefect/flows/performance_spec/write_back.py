@@ -0,0 +1,106 @@
+# Batched write-back of updated entities to OSW.
+# Entities loaded by a scheduler are tracked here and updated in memory by any number of
+# results. A flush stores each entity once, with bounded concurrency, and pages whose content
+# did not change since they were loaded (or last stored) are not written at all.
+# Failed stores are raised by close() (and at the end of the with-block), so a flow does not
+# report success while its results never reached the wiki.
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+import metrics
+
+
+def _key(entity) -> str:
+    return str(entity.uuid)
+
+
+def _content(entity) -> str:
+    return entity.json(exclude_none=True)
+
+
+class WriteBack:
+    """Coalesces updates per entity and stores changed entities in bulk"""
+
+    def __init__(self, osw, max_concurrency: int = 4):
+        self.osw = osw
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+        self._lock = threading.Lock()
+        self._entities: Dict[str, object] = {}
+        self._snapshots: Dict[str, str] = {}
+        self._runs: Dict[str, Dict[str, object]] = {}
+        self._futures: List[Future] = []
+        self.errors: Dict[str, Exception] = {} # failed stores by uuid
+        self.stored = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def track(self, entity):
+        """Register a loaded entity, returns the tracked instance for its uuid.
+        Pydantic may hand out copies of an entity, updates must go to the tracked one."""
+        key = _key(entity)
+        with self._lock:
+            if key not in self._entities:
+                self._entities[key] = entity
+                self._snapshots[key] = _content(entity)
+                self._runs[key] = {str(run.uuid): run for run in getattr(entity, "workflow_runs", None) or []}
+            return self._entities[key]
+
+    def run(self, entity, run_uuid):
+        """Workflow run of a tracked entity by uuid, None if it has no such run"""
+        return self._runs.get(_key(entity), {}).get(str(run_uuid))
+
+    def changed(self, entity) -> bool:
+        key = _key(entity)
+        return _content(self._entities.get(key, entity)) != self._snapshots.get(key)
+
+    def _store(self, key: str):
+        try:
+            with metrics.timer("osw_store_seconds"):
+                self.osw.store_entity(self._entities[key])
+        except Exception as e:
+            print(f"Storing {key} failed: {e}")
+            with self._lock:
+                # a later flush stores the entity again
+                self._snapshots.pop(key, None)
+                self.failed += 1
+                self.errors[key] = e
+            raise
+        with self._lock:
+            self.stored += 1
+            self.errors.pop(key, None)
+
+    def flush(self, entities: Optional[list] = None) -> List[Future]:
+        """Store the given (default: all) tracked entities that changed, without waiting"""
+        keys = [_key(entity) for entity in entities] if entities is not None else list(self._entities)
+        futures = []
+        for key in keys:
+            content = _content(self._entities[key])
+            with self._lock:
+                if content == self._snapshots.get(key):
+                    self.skipped += 1
+                    metrics.inc("osw_store_skipped_total")
+                    continue
+                metrics.observe("osw_store_bytes", len(content))
+                # the snapshot is taken at submit time, a second flush does not store twice
+                self._snapshots[key] = content
+            futures.append(self._executor.submit(self._store, key))
+        self._futures.extend(futures)
+        return futures
+
+    def close(self, raise_errors: bool = True):
+        """Wait for all pending stores, raises a RuntimeError if entities could not be stored"""
+        wait(self._futures)
+        self._futures = []
+        self._executor.shutdown(wait=True)
+        print(f"Write-back: {self.stored} stored, {self.skipped} unchanged, {self.failed} failed")
+        if self.errors and raise_errors:
+            raise RuntimeError(f"Storing {len(self.errors)} entities failed: {self.errors}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # an exception of the with-block takes precedence
+        self.close(raise_errors=exc_type is None)